@@ -1,24 +1,40 @@
 import os
 import json
-import hashlib
+import time
 from datetime import datetime
-from io import BytesIO
-from typing import Set, Dict, Tuple
+from functools import partial
+from typing import Callable, Set, Dict, Optional, Tuple
+from urllib.parse import quote
 
-from fastapi import APIRouter, File, UploadFile, HTTPException, Request, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Request, BackgroundTasks, Query
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from PIL import Image
 from pydantic import BaseModel, EmailStr, Field
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 
-from app.services.image_processing import process_image
-from app.utils.cleanup import delete_old_files
+from app.services.image_processing import (
+    process_image, process_preview, pipeline_fingerprint, PREVIEW_SCALES, PROCESS_BANDS,
+)
+from app.services.worker_pool import processing_pool, PoolBusy, PoolSaturated
+from app.services.result_cache import result_cache, cache_key
+from app.services.singleflight import processing_flights
+from app.services.decoded_cache import decoded_cache, prefetch_decoded
+from app.services.scheduler import scheduler, ClientQueueFull, LANE_BATCH, LANE_INTERACTIVE
+from app.services.jobs import (
+    job_queue, Job, JobQueueFull, JOB_PRIORITY_DEFAULT, JOB_PRIORITY_MAX, JOB_PRIORITY_MIN,
+)
+from app.utils.blob_store import blob_store, file_digest
+from app.utils.catalog import catalog
+from app.utils.storage_budget import storage_budget
+from app.utils import metrics
+from app.utils.uploads import StreamedUpload, receive_multipart_file, receive_raw_file
 
 # Router
 router = APIRouter()
 
-# Directorios de almacenamiento
+# Espacios de nombres (alias en el catálogo; los ficheros están en el almacén de blobs)
 UPLOAD_FOLDER: str = "uploads/"
 PROCESSED_FOLDER: str = "processed/"
 
@@ -26,6 +42,12 @@ PROCESSED_FOLDER: str = "processed/"
 VALID_IMAGE_TYPES: Set[str] = {"image/jpeg", "image/png", "image/jpg", "image/webp"}
 MAX_FILE_SIZE_MB: int = 4
 
+# Procesar por adelantado tras /upload/ si el pool está libre (0 = desactivado)
+SPECULATIVE_PROCESSING: int = int(os.getenv("SPECULATIVE_PROCESSING", "1"))
+
+# Comentario SSE periódico para que proxies/balanceadores no corten el stream
+SSE_HEARTBEAT_SECONDS: int = 15
+
 # Donaciones
 MIN_DONATION: float = 2.50
 DONATIONS_FILE: str = "donations.json"
@@ -37,6 +59,11 @@ class ContactMessage(BaseModel):
     message: str = Field(..., min_length=10, max_length=1000)
 
 
+class UploadCheck(BaseModel):
+    sha256: str = Field(..., pattern=r"^[0-9a-fA-F]{64}$")
+    filename: str = Field("image", max_length=255)
+
+
 # --- Utilidades internas ---
 _EXT_BY_MIME: Dict[str, str] = {
     "image/jpeg": ".jpg",
@@ -46,22 +73,309 @@ _EXT_BY_MIME: Dict[str, str] = {
 }
 
 
-def _derive_filenames(original: str, data: bytes, mime: str) -> Tuple[str, str]:
+def _derive_filenames(original: str, digest: str, mime: str) -> Tuple[str, str]:
     """
-    Genera nombres únicos basados en contenido (hash).
-    Devuelve (nombre_subida, nombre_procesado).
+    Genera nombres únicos basados en contenido (hash SHA-256 en hex).
+    Devuelve (nombre_subida, nombre_procesado). Si el nombre corto ya es de
+    otro contenido (colisión de los 8 primeros caracteres) se alarga el hash.
+    Del original solo se usa el último componente (con `/` o `\\`) sin
+    caracteres de control, así el nombre siempre pasa _alias().
     """
-    stem, _ = os.path.splitext(os.path.basename(original or "image"))
+    base = os.path.basename((original or "").replace("\\", "/"))
+    stem, _ = os.path.splitext("".join(c for c in base if c.isprintable()))
+    stem = stem or "image"
     ext = _EXT_BY_MIME.get(mime)
     if not ext:
         raise HTTPException(status_code=400, detail="Unsupported MIME type")
 
-    h8 = hashlib.sha256(data).hexdigest()[:8]
-    stored_name = f"{stem}__{h8}{ext}"
-    processed_name = f"processed_{stem}__{h8}.jpg"
+    for length in (8, 16, 64):
+        h = digest[:length]
+        stored_name = f"{stem}__{h}{ext}"
+        known = catalog.get(os.path.join(UPLOAD_FOLDER, stored_name))
+        if known is None or known["sha256"] == digest:
+            break
+        metrics.incr("upload_name_collisions")
+    processed_name = f"processed_{stem}__{h}.jpg"
     return stored_name, processed_name
 
 
+def _claim_known_upload(original: str, digest: str) -> Optional[Tuple[str, str]]:
+    """
+    Si el catálogo tiene una subida con ese SHA-256 completo, devuelve
+    (nombre_subida, nombre_procesado) como lo haría /upload/ para `original`,
+    creando ese nombre como alias del mismo blob si no existía.
+    """
+    for known in catalog.find_sha256(digest, kind="upload"):
+        mime = known["mime"]
+        if mime not in _EXT_BY_MIME:
+            continue
+        stored_name, processed_name = _derive_filenames(original, digest, mime)
+        # El cliente va a usarlo: el alias cuenta como recién escrito y no caduca ahora
+        if blob_store.alias(os.path.join(UPLOAD_FOLDER, stored_name), digest,
+                            mime=mime, width=known["width"], height=known["height"]):
+            return stored_name, processed_name
+    return None
+
+
+def _alias(folder: str, filename: str) -> str:
+    """Alias `folder/filename`; 400 si `filename` no es un nombre simple (sin rutas ni `..`)."""
+    if filename in ("", ".", "..") or os.path.basename(filename) != filename or "\\" in filename:
+        raise HTTPException(status_code=400, detail="Nombre de archivo no válido")
+    return os.path.join(folder, filename)
+
+
+_NO_CACHE_HEADERS: Dict[str, str] = {
+    "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+    "Pragma": "no-cache",
+    "Expires": "0",
+}
+
+
+def _byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    `Range: bytes=a-b` (un solo tramo) -> (inicio, fin exclusivo); None para
+    enviarlo entero (sin Range, o uno que no se entiende). 416 si no cabe.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), (int(last) + 1 if last else size)
+        else:
+            start, end = max(size - int(last), 0), size  # sufijo: los últimos N bytes
+    except ValueError:
+        return None
+    end = min(end, size)
+    if start >= end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _blob_response(
+    request: Request,
+    digest: str,
+    size: Optional[int],
+    media_type: str,
+    headers: Optional[Dict[str, str]] = None,
+    filename: Optional[str] = None,
+) -> Response:
+    """
+    Respuesta con el contenido de un blob. Si está en disco, FileResponse
+    (sendfile y Range incluidos); si no (backend remoto), se reenvía por
+    bloques desde el backend, también con Range, sin cargarlo en memoria.
+    """
+    path = blob_store.cached_path(digest)
+    if path is not None:
+        return FileResponse(path=path, media_type=media_type, headers=headers, filename=filename)
+
+    headers = dict(headers or {})
+    if filename is not None:
+        headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+    status_code = 200
+    start, end = 0, None
+    if size is not None:
+        headers["Accept-Ranges"] = "bytes"
+        start, end = _byte_range(request.headers.get("range"), size) or (0, size)
+        if (start, end) != (0, size):
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        headers["Content-Length"] = str(end - start)
+    return StreamingResponse(
+        blob_store.read(digest, start, end), status_code=status_code, media_type=media_type, headers=headers,
+    )
+
+
+class _ReleasingResponse(Response):
+    """
+    Envía `response` y después llama a `release`, también si el envío falla
+    (fichero borrado, 416 de FileResponse, cliente que se va): un
+    BackgroundTask solo se ejecuta cuando todo ha ido bien.
+    """
+
+    def __init__(self, response: Response, release: Callable[[], None]):
+        self.response = response
+        self.release = release
+        self.status_code = response.status_code
+        self.raw_headers = response.raw_headers
+        self.background = None
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.release()
+
+
+def _pinned_blob_response(alias: str, request: Request, digest: str, size: Optional[int], media_type: str,
+                          headers: Optional[Dict[str, str]] = None, filename: Optional[str] = None) -> Response:
+    """_blob_response() con `alias` protegido de la expulsión LRU hasta terminar de enviarlo."""
+    storage_budget.pin(alias)
+    try:
+        response = _blob_response(request, digest, size, media_type, headers, filename)
+    except BaseException:
+        storage_budget.unpin(alias)
+        raise
+    return _ReleasingResponse(response, partial(storage_budget.unpin, alias))
+
+
+def _busy(e: PoolSaturated) -> HTTPException:
+    if isinstance(e, ClientQueueFull):
+        return HTTPException(
+            status_code=429,
+            detail="Demasiadas peticiones en espera, inténtalo de nuevo en unos segundos.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    return HTTPException(
+        status_code=503,
+        detail="El servidor está ocupado, inténtalo de nuevo en unos segundos.",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def _client_id(request: Request) -> str:
+    """
+    Cliente para el reparto justo: el token de sesión si lo envía el frontend,
+    si no la IP (detrás de un proxy, arrancar uvicorn con --proxy-headers).
+    """
+    token = request.headers.get("x-session-token")
+    if token:
+        return f"token:{token[:128]}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+async def _run_in_pool(client: str, fn, *args):
+    """Ejecuta trabajo CPU-bound en el pool de procesos; 503 + Retry-After si está lleno."""
+    try:
+        async with scheduler.slot(client, LANE_INTERACTIVE):
+            return await processing_pool.run(fn, *args)
+    except PoolSaturated as e:
+        raise _busy(e)
+
+
+async def _process_once(input_path: Optional[str], output_alias: str, digest: Optional[str] = None,
+                        source: Optional[str] = None, upload_name: Optional[str] = None,
+                        low_priority: bool = False, task_id: Optional[str] = None,
+                        client: Optional[str] = None, lane: str = LANE_INTERACTIVE) -> str:
+    """
+    Procesa (o sirve desde la caché) `input_path` y guarda el resultado como
+    `output_alias`; devuelve el SHA-256 del blob resultante. `source` es el alias
+    de la subida; sin `input_path` se usa su blob (solo se descarga del
+    backend si hay que procesar). PoolSaturated si el pool está lleno. Con
+    `client` espera turno en el planificador (carril `lane`).
+    """
+    # Ni la entrada ni la salida se expulsan por presupuesto mientras tanto
+    if source:
+        storage_budget.touch(source)
+    with storage_budget.pinned(*filter(None, (source, output_alias))):
+        # Mismo contenido + mismos parámetros + mismo pipeline => mismo resultado
+        source_row = (await run_in_threadpool(catalog.get, source) if source else None) or {}
+        if digest is None:
+            digest = source_row.get("sha256") or await run_in_threadpool(file_digest, input_path)
+        params = {"format": "jpg"}
+        key = cache_key(digest, params)
+        # El resultado conserva las dimensiones de la entrada
+        meta = dict(source=source, params=params, pipeline=pipeline_fingerprint(), mime="image/jpeg",
+                    width=source_row.get("width"), height=source_row.get("height"))
+        cached = await run_in_threadpool(result_cache.fetch, key, output_alias, **meta)
+        if cached is not None:
+            return cached
+
+        # CPU-bound: se ejecuta en el pool de procesos para no bloquear el event loop
+        # Si la subida ya se decodificó en segundo plano, se reutiliza
+        decoded = decoded_cache.lookup(upload_name) if upload_name else None
+        if input_path is None:
+            input_path = await run_in_threadpool(blob_store.local_path, digest)
+        result_path = blob_store.staging_path(".jpg")
+        args = (process_image, input_path, result_path, PROCESS_BANDS, decoded, task_id)
+        try:
+            if client is None:
+                started = time.perf_counter()
+                stats = await processing_pool.run(*args, low_priority=low_priority)
+            else:
+                async with scheduler.slot(client, lane):
+                    started = time.perf_counter()
+                    stats = await processing_pool.run(*args)
+            meta["process_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            output_digest = await run_in_threadpool(result_cache.store, key, result_path, output_alias, **meta)
+        finally:
+            if os.path.exists(result_path):
+                os.remove(result_path)
+        if decoded is not None:
+            # Ya está en la caché de resultados: la imagen decodificada sobra
+            decoded_cache.discard(upload_name)
+
+        for name, value in stats.items():
+            metrics.incr(name, value)
+        metrics.incr("images_processed")
+        return output_digest
+
+
+def _processed_name(stored_name: str) -> str:
+    """Nombre de salida en `processed/` para un nombre guardado (que ya incluye hash)."""
+    stem, _ = os.path.splitext(os.path.basename(stored_name))
+    return f"processed_{stem}.jpg"
+
+
+# Salidas generadas por adelantado que aún no ha pedido ningún /process/
+_speculative_outputs: Dict[str, None] = {}
+_SPECULATIVE_TRACKED = 1024
+
+
+def _claim_speculative(out_name: str) -> None:
+    if out_name in _speculative_outputs:
+        del _speculative_outputs[out_name]
+        metrics.incr("speculative_hits")
+
+
+async def _speculate(stored_name: str, stored_path: str) -> None:
+    """
+    Tras una subida: decodifica y procesa por adelantado, en baja prioridad,
+    mientras el pool tenga hijos libres. Antes de cada paso se mira la carga
+    y el pool lo vuelve a mirar al enviar (PoolBusy): con los hijos ocupados
+    se abandona. Un /process/ posterior se une al trabajo en curso
+    (single-flight) o encuentra el resultado hecho.
+    """
+    await prefetch_decoded(stored_name, stored_path)
+    if not SPECULATIVE_PROCESSING:
+        return
+
+    out_name = _processed_name(stored_name)
+    output_alias = os.path.join(PROCESSED_FOLDER, out_name)
+    if (not processing_pool.idle or processing_flights.get(out_name)
+            or await run_in_threadpool(catalog.get, output_alias)):
+        metrics.incr("speculative_skipped")
+        return
+
+    metrics.incr("speculative_started")
+    _speculative_outputs[out_name] = None
+    if len(_speculative_outputs) > _SPECULATIVE_TRACKED:
+        _speculative_outputs.pop(next(iter(_speculative_outputs)))
+    try:
+        await processing_flights.run(out_name, lambda: _process_once(
+            stored_path, output_alias, source=os.path.join(UPLOAD_FOLDER, stored_name),
+            upload_name=stored_name, low_priority=True,
+        ))
+    except PoolBusy:
+        metrics.incr("speculative_skipped")
+        _speculative_outputs.pop(out_name, None)
+    except Exception:
+        # Un /process/ explícito lo volverá a intentar y devolverá el error
+        _speculative_outputs.pop(out_name, None)
+
+
+async def _process_flight(out_name: str, fn):
+    """
+    processing_flights.run para peticiones explícitas. Si se unió a un
+    procesado especulativo que el pool rechazó al enviarlo (PoolBusy), lo
+    lanza de nuevo como propio en vez de devolver el error.
+    """
+    try:
+        return await processing_flights.run(out_name, fn)
+    except PoolBusy:
+        return await processing_flights.run(out_name, fn)
+
+
 # ------------------- Rutas -------------------
 @router.post("/contact")
 async def receive_contact_message(data: ContactMessage):
@@ -112,47 +426,136 @@ async def receive_contact_message(data: ContactMessage):
     return {"message": "Message received successfully. We will get back to you soon."}
 
 
-@router.post("/upload/")
-async def upload_image(
-    file: UploadFile = File(...),
-    background_tasks: BackgroundTasks = None,  # <- sin Optional ni default None semántico
-):
-    """
-    Sube imagen a `uploads/` con nombre basado en hash de contenido.
-    Evita colisiones cuando el usuario reusa el mismo nombre.
-    """
-    if file.content_type not in VALID_IMAGE_TYPES:
-        raise HTTPException(status_code=400, detail="Invalid image format. Only JPG/PNG/WebP are allowed.")
+_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
 
-    contents = await file.read()
 
-    size_mb = len(contents) / (1024 * 1024)
-    if size_mb > MAX_FILE_SIZE_MB:
-        raise HTTPException(status_code=400, detail=f"The file exceeds the maximum allowed size {MAX_FILE_SIZE_MB} MB.")
+_UPLOAD_RAW_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            mime: {"schema": {"type": "string", "format": "binary"}}
+            for mime in ("application/octet-stream", "image/jpeg", "image/png", "image/webp")
+        },
+    }
+}
 
-    # Validar que sea una imagen real
+
+def _verify_image(path: str) -> Tuple[int, int]:
+    """Comprueba que sea una imagen real; devuelve (ancho, alto)."""
     try:
-        Image.open(BytesIO(contents)).verify()
+        with Image.open(path) as img:
+            size = img.size
+            img.verify()
+        return size
     except Exception:
         raise HTTPException(status_code=400, detail="The file is not a valid image.")
 
-    stored_name, processed_name = _derive_filenames(file.filename, contents, file.content_type)
 
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    file_path = os.path.join(UPLOAD_FOLDER, stored_name)
+async def _store_upload(upload: StreamedUpload, background_tasks: BackgroundTasks) -> Dict[str, str]:
+    """Valida y guarda (con dedupe por contenido) un fichero ya recibido en temporal."""
+    try:
+        # Validar que sea una imagen real
+        width, height = await run_in_threadpool(_verify_image, upload.tmp_path)
+
+        stored_name, processed_name = await run_in_threadpool(
+            _derive_filenames, upload.filename, upload.digest, upload.mime,
+        )
 
-    # Solo escribe si no existe (dedupe por contenido)
-    if not os.path.exists(file_path):
-        with open(file_path, "wb") as buffer:
-            buffer.write(contents)
+        # El contenido se guarda una sola vez; el nombre es un alias de ese blob
+        stored_path = await run_in_threadpool(
+            blob_store.ingest, upload.tmp_path, os.path.join(UPLOAD_FOLDER, stored_name), upload.digest,
+            mime=upload.mime, width=width, height=height,
+        )
+    finally:
+        upload.discard()
 
     # BackgroundTasks lo inyecta FastAPI (instancia válida)
-    background_tasks.add_task(delete_old_files)
+    # Casi siempre sigue un /process/: adelantar decodificación y procesado
+    background_tasks.add_task(_speculate, stored_name, stored_path)
 
     return {
         "message": "Imagen subida con éxito",
         "filename": stored_name,  # ← usar este para /process/
-        "original_filename": file.filename,
+        "original_filename": upload.filename,
+        "processed_suggested": processed_name,
+    }
+
+
+@router.post("/upload/", openapi_extra=_UPLOAD_OPENAPI)
+async def upload_image(
+    request: Request,
+    background_tasks: BackgroundTasks = None,  # <- sin Optional ni default None semántico
+):
+    """
+    Sube imagen a `uploads/` con nombre basado en hash de contenido.
+    Evita colisiones cuando el usuario reusa el mismo nombre.
+    El cuerpo se lee por bloques (hash incremental y límite de tamaño sobre la
+    marcha) a un temporal de `uploads/` que luego solo se renombra.
+    """
+    upload = await receive_multipart_file(
+        request,
+        field="file",
+        folder=blob_store.staging,
+        max_bytes=MAX_FILE_SIZE_MB * 1024 * 1024,
+        allowed_types=VALID_IMAGE_TYPES,
+    )
+    return await _store_upload(upload, background_tasks)
+
+
+@router.post("/upload/raw", openapi_extra=_UPLOAD_RAW_OPENAPI)
+async def upload_image_raw(
+    request: Request,
+    filename: str = "image",
+    background_tasks: BackgroundTasks = None,
+):
+    """
+    Igual que /upload/ pero el cuerpo es directamente la imagen
+    (`application/octet-stream` o `image/*`), sin multipart. Pensado para
+    clientes de API y el CLI por lotes. `filename` es el nombre original.
+    """
+    upload = await receive_raw_file(
+        request,
+        folder=blob_store.staging,
+        max_bytes=MAX_FILE_SIZE_MB * 1024 * 1024,
+        allowed_types=VALID_IMAGE_TYPES,
+        filename=filename,
+    )
+    return await _store_upload(upload, background_tasks)
+
+
+@router.post("/upload/check")
+async def check_upload(data: UploadCheck):
+    """
+    Negociación previa a la subida: el cliente envía el SHA-256 del fichero.
+    Si ya está guardado se responde como /upload/ (con `exists: true`) y no
+    hace falta enviar el cuerpo; si no, `exists: false` y se sube normalmente.
+    """
+    digest = data.sha256.lower()
+    names = await run_in_threadpool(_claim_known_upload, data.filename, digest)
+    if names is None:
+        metrics.incr("upload_check_misses")
+        return {"exists": False}
+
+    metrics.incr("upload_check_hits")
+    stored_name, processed_name = names
+    return {
+        "exists": True,
+        "message": "Imagen subida con éxito",
+        "filename": stored_name,
+        "original_filename": data.filename,
         "processed_suggested": processed_name,
     }
 
@@ -160,44 +563,225 @@ async def upload_image(
 @router.post("/process/")
 async def process_uploaded_image(
     filename: str,
-    background_tasks: BackgroundTasks = None,
+    request: Request,
 ):
     """
     Procesa una imagen de `uploads/` y guarda en `processed/` con nombre único.
     Salida: JPG. Usa hash en el nombre para evitar choques por mismo nombre original.
     """
-    input_path = os.path.join(UPLOAD_FOLDER, filename)
+    source = _alias(UPLOAD_FOLDER, filename)
+    digest = await run_in_threadpool(blob_store.lookup, source)
 
-    if not os.path.exists(input_path):
+    if digest is None:
         return {"error": "Archivo no encontrado"}
 
     # Derivar nombre de salida desde el nombre almacenado (que ya incluye hash)
-    stem, _ = os.path.splitext(os.path.basename(filename))
-    out_name = f"processed_{stem}.jpg"
-    output_path = os.path.join(PROCESSED_FOLDER, out_name)
+    out_name = _processed_name(filename)
+    output_alias = os.path.join(PROCESSED_FOLDER, out_name)
+    _claim_speculative(out_name)
 
-    process_image(input_path, output_path)
-
-    background_tasks.add_task(delete_old_files)
+    # Peticiones simultáneas para el mismo fichero comparten un único procesado
+    client = _client_id(request)
+    try:
+        await _process_flight(out_name, lambda: _process_once(
+            None, output_alias, digest, source=source, upload_name=filename, client=client,
+        ))
+    except PoolSaturated as e:
+        raise _busy(e)
 
     return {"message": "Imagen procesada con éxito", "filename": out_name}
 
 
+@router.post("/jobs/", status_code=202)
+async def create_job(
+    filename: str,
+    request: Request,
+    priority: int = Query(JOB_PRIORITY_DEFAULT, ge=JOB_PRIORITY_MIN, le=JOB_PRIORITY_MAX),
+):
+    """
+    Igual que /process/ pero asíncrono: encola el procesado y devuelve el id
+    del trabajo al momento. Estado en /jobs/{id}; progreso por etapas (SSE)
+    en /jobs/{id}/events. `priority`: 0 = más urgente. Los trabajos van por
+    el carril `batch` del planificador: no retrasan a /process/ ni /preview/.
+    """
+    source = _alias(UPLOAD_FOLDER, filename)
+    digest = await run_in_threadpool(blob_store.lookup, source)
+    if digest is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+
+    out_name = _processed_name(filename)
+    output_alias = os.path.join(PROCESSED_FOLDER, out_name)
+    _claim_speculative(out_name)
+
+    client = _client_id(request)
+
+    async def run(job: Job) -> Dict[str, str]:
+        await _process_flight(out_name, lambda: _process_once(
+            None, output_alias, digest, source=source, upload_name=filename,
+            task_id=job.id, client=client, lane=LANE_BATCH,
+        ))
+        return {"filename": out_name}
+
+    try:
+        job = job_queue.submit(run, filename, priority, client)
+    except JobQueueFull:
+        raise _busy(PoolSaturated(processing_pool.retry_after))
+
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+    }
+
+
+def _get_job(job_id: str) -> Job:
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Estado actual del trabajo (status, etapa, progreso 0..1 y resultado)."""
+    return _get_job(job_id).to_dict()
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """
+    Server-Sent Events con el estado del trabajo en cada cambio de etapa
+    (`event:` = status). El stream se cierra al terminar (done/error).
+    """
+    job = _get_job(job_id)
+
+    async def stream():
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"event: {job.status}\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.done:
+                    return
+            if await request.is_disconnected():
+                return
+            if not await job.wait_change(version, SSE_HEARTBEAT_SECONDS):
+                yield ": keep-alive\n\n"
+
+    headers = dict(_NO_CACHE_HEADERS)
+    headers["X-Accel-Buffering"] = "no"  # nginx: no acumular el stream
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers)
+
+
+@router.post("/upload-and-process/", openapi_extra=_UPLOAD_OPENAPI)
+async def upload_and_process_image(
+    request: Request,
+):
+    """
+    /upload/ + /process/ en una sola petición: devuelve directamente el JPG
+    procesado. Se valida como /upload/ (cabecera, sin decodificar), se
+    procesa el fichero recibido sin releerlo y se guardan subida y resultado
+    como en las rutas separadas; sus nombres van en `X-Upload-Filename` /
+    `X-Processed-Filename`. Un fallo al procesar es un error del servidor.
+    """
+    upload = await receive_multipart_file(
+        request,
+        field="file",
+        folder=blob_store.staging,
+        max_bytes=MAX_FILE_SIZE_MB * 1024 * 1024,
+        allowed_types=VALID_IMAGE_TYPES,
+    )
+    try:
+        width, height = await run_in_threadpool(_verify_image, upload.tmp_path)
+        stored_name, processed_name = await run_in_threadpool(
+            _derive_filenames, upload.filename, upload.digest, upload.mime,
+        )
+        stored_alias = os.path.join(UPLOAD_FOLDER, stored_name)
+        # Primero la subida (como /upload/): el resultado hereda sus dimensiones en el catálogo
+        stored_path = await run_in_threadpool(
+            blob_store.ingest, upload.tmp_path, stored_alias, upload.digest,
+            mime=upload.mime, width=width, height=height,
+        )
+    finally:
+        upload.discard()
+
+    # Se procesa el fichero ya guardado; el hash del stream evita releerlo
+    client = _client_id(request)
+    try:
+        output_digest = await _process_flight(processed_name, lambda: _process_once(
+            stored_path, os.path.join(PROCESSED_FOLDER, processed_name), upload.digest,
+            source=stored_alias, client=client,
+        ))
+    except PoolSaturated as e:
+        raise _busy(e)
+
+    headers = dict(_NO_CACHE_HEADERS)
+    headers["X-Upload-Filename"] = stored_name
+    headers["X-Processed-Filename"] = processed_name
+    row = await run_in_threadpool(catalog.get, os.path.join(PROCESSED_FOLDER, processed_name)) or {}
+    return _blob_response(request, output_digest, row.get("size"), "image/jpeg", headers)
+
+
+@router.get("/uploads/{filename}")
+async def get_uploaded_image(filename: str, request: Request):
+    """Devuelve una imagen subida (su blob) con headers no-cache, para mostrar el original."""
+    alias = _alias(UPLOAD_FOLDER, filename)
+    row = await run_in_threadpool(catalog.get, alias)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    # Acceso para la expulsión LRU de uploads/; protegido mientras se envía
+    storage_budget.touch(alias)
+    return _pinned_blob_response(
+        alias, request, row["sha256"], row["size"], row["mime"] or "application/octet-stream", _NO_CACHE_HEADERS,
+    )
+
+
 @router.get("/processed/{filename}")
-async def get_processed_image(filename: str):
+async def get_processed_image(filename: str, request: Request):
     """Devuelve una imagen procesada desde `processed/` con headers no-cache."""
-    path = os.path.join(PROCESSED_FOLDER, filename)
-    if not os.path.exists(path):
+    alias = _alias(PROCESSED_FOLDER, filename)
+    # Si se está generando ahora mismo, esperar al resultado en vez de dar 404
+    await processing_flights.wait(filename)
+    row = await run_in_threadpool(catalog.get, alias)
+    if row is None:
         raise HTTPException(status_code=404, detail="Imagen procesada no encontrada")
-    resp = FileResponse(
-        path=path,
-        media_type="application/octet-stream",  # fuerza descarga
+    # Acceso para la expulsión LRU; protegido hasta terminar de enviarlo
+    storage_budget.touch(alias)
+    return _pinned_blob_response(
+        alias, request, row["sha256"], row["size"],
+        "application/octet-stream",  # fuerza descarga
+        _NO_CACHE_HEADERS,
         filename=filename,
     )
-    resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-    resp.headers["Pragma"] = "no-cache"
-    resp.headers["Expires"] = "0"
-    return resp
+
+
+@router.get("/preview/{filename}")
+async def preview_image(request: Request, filename: str, scale: int = 4, thumbnail: bool = False):
+    """
+    Vista previa procesada de una imagen de `uploads/` a 1/`scale` de resolución.
+    Con `thumbnail=true` usa la miniatura EXIF si existe (aún más rápido).
+    No se guarda nada en disco: devuelve el JPEG directamente.
+    """
+    if scale not in PREVIEW_SCALES:
+        raise HTTPException(status_code=400, detail=f"scale debe ser uno de {list(PREVIEW_SCALES)}")
+    digest = await run_in_threadpool(blob_store.lookup, _alias(UPLOAD_FOLDER, filename))
+    if digest is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    input_path = await run_in_threadpool(blob_store.local_path, digest)
+
+    data = await _run_in_pool(_client_id(request), process_preview, input_path, scale, thumbnail)
+    metrics.incr("previews_processed")
+    return Response(content=data, media_type="image/jpeg", headers=_NO_CACHE_HEADERS)
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Contadores internos del proceso (pool, arena de buffers, etc.)."""
+    metrics.set_value("processing_pending", processing_pool.pending)
+    metrics.set_value("jobs_queued", job_queue.queued)
+    scheduler.publish()
+    return metrics.snapshot()
 
 
 @router.post("/donation/")
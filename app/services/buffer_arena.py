@@ -0,0 +1,81 @@
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence
+
+import numpy as np
+
+# Memoria máxima que cada proceso conserva entre peticiones
+ARENA_MAX_BYTES: int = int(os.getenv("ARENA_MAX_BYTES", str(512 * 1024 * 1024)))
+_MIN_BUCKET: int = 64 * 1024
+
+
+class BufferArena:
+    """
+    Buffers reutilizables agrupados por tamaño para los intermedios del pipeline.
+    Cada proceso del pool tiene la suya (`arena`), así que no necesita locks.
+
+    Uso:
+        with arena.request():
+            frame = arena.take((h, w, 3))
+            ...
+    Los arrays entregados solo son válidos dentro del `with`.
+    """
+
+    def __init__(self, max_bytes: int = ARENA_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._free: Dict[int, List[np.ndarray]] = {}
+        self._leased: List[np.ndarray] = []
+        self._retained = 0
+        # Contadores de la petición en curso (tamaño de bucket, lo que ocupa en memoria)
+        self.allocated_bytes = 0
+        self.reused_bytes = 0
+
+    @staticmethod
+    def bucket_size(nbytes: int) -> int:
+        """Redondea al siguiente octavo de potencia de 2 (desperdicio <= 25%)."""
+        if nbytes <= _MIN_BUCKET:
+            return _MIN_BUCKET
+        step = (1 << (nbytes - 1).bit_length()) // 8
+        return -(-nbytes // step) * step
+
+    def take(self, shape: Sequence[int], dtype=np.uint8) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        size = self.bucket_size(nbytes)
+        free = self._free.get(size)
+        if free:
+            raw = free.pop()
+            self._retained -= size
+            self.reused_bytes += size
+        else:
+            raw = np.empty(size, dtype=np.uint8)
+            self.allocated_bytes += size
+        self._leased.append(raw)
+        return raw[:nbytes].view(dtype).reshape(shape)
+
+    def release_all(self) -> None:
+        for raw in self._leased:
+            self._free.setdefault(raw.nbytes, []).append(raw)
+            self._retained += raw.nbytes
+        self._leased.clear()
+        # Por encima del presupuesto se sueltan primero los buffers más grandes
+        for size in sorted(self._free, reverse=True):
+            free = self._free[size]
+            while free and self._retained > self.max_bytes:
+                free.pop()
+                self._retained -= size
+            if not free:
+                del self._free[size]
+
+    @contextmanager
+    def request(self) -> Iterator["BufferArena"]:
+        self.allocated_bytes = 0
+        self.reused_bytes = 0
+        try:
+            yield self
+        finally:
+            self.release_all()
+
+
+# Una por proceso (cada worker del pool importa este módulo por separado)
+arena = BufferArena()
@@ -0,0 +1,153 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import Optional
+
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+
+from app.services.image_processing import TILED_MIN_PIXELS, decode_to_shared
+from app.services.worker_pool import PoolBusy, processing_pool
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración (variables de entorno); 0 desactiva la caché
+DECODED_CACHE_MAX_BYTES: int = int(os.getenv("DECODED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DECODED_CACHE_TTL_SECONDS: int = int(os.getenv("DECODED_CACHE_TTL_SECONDS", "120"))
+
+
+class _Entry:
+    __slots__ = ("shm", "expires", "ready")
+
+    def __init__(self, shm: shared_memory.SharedMemory, expires: float):
+        self.shm = shm
+        self.expires = expires
+        self.ready = False
+
+
+class DecodedCache:
+    """
+    LRU de imágenes decodificadas (HxWx3 uint8) por nombre guardado en
+    `uploads/`, con presupuesto de bytes y caducidad. Los píxeles viven en
+    memoria compartida: el proceso principal solo reserva y libera bloques,
+    decodifican y leen los hijos del pool (ver decode_to_shared/process_image).
+    """
+
+    def __init__(self, max_bytes: int = DECODED_CACHE_MAX_BYTES, ttl: int = DECODED_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.ttl > 0
+
+    def _drop(self, name: str) -> None:
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        self._bytes -= entry.shm.size
+        entry.shm.close()
+        try:
+            entry.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _publish(self) -> None:
+        metrics.set_value("decoded_cache_bytes", self._bytes)
+        metrics.set_value("decoded_cache_entries", len(self._entries))
+
+    def _expire(self, now: float) -> None:
+        for name in [n for n, e in self._entries.items() if e.expires <= now]:
+            self._drop(name)
+            metrics.incr("decoded_cache_expired")
+
+    def reserve(self, name: str, nbytes: int) -> Optional[str]:
+        """Crea el bloque para `name` (expulsando lo más antiguo si hace falta) y devuelve su nombre."""
+        if not self.enabled or nbytes > self.max_bytes:
+            return None
+        with self._lock:
+            self._drop(name)
+            self._expire(time.monotonic())
+            while self._entries and self._bytes + nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                metrics.incr("decoded_cache_evictions")
+            shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._entries[name] = _Entry(shm, time.monotonic() + self.ttl)
+            self._bytes += shm.size
+            self._publish()
+            return shm.name
+
+    def mark_ready(self, name: str, shm_name: str) -> None:
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.shm.name == shm_name:
+                entry.ready = True
+
+    def lookup(self, name: str) -> Optional[str]:
+        """Bloque con la imagen `name` ya decodificada, o None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(name)
+            if entry is None or not entry.ready:
+                metrics.incr("decoded_cache_misses")
+                self._publish()
+                return None
+            self._entries.move_to_end(name)
+            metrics.incr("decoded_cache_hits")
+            return entry.shm.name
+
+    def discard(self, name: str) -> None:
+        with self._lock:
+            self._drop(name)
+            self._publish()
+
+    def clear(self) -> None:
+        with self._lock:
+            for name in list(self._entries):
+                self._drop(name)
+            self._publish()
+
+
+def _frame_bytes(path: str) -> int:
+    with Image.open(path) as img:
+        return img.size[0] * img.size[1] * 3
+
+
+async def prefetch_decoded(name: str, path: str) -> None:
+    """
+    Tras una subida: decodifica `path` en la caché si hay un hijo del pool
+    libre (nunca quita hueco a un /process/ explícito). Los fallos se ignoran:
+    /process/ decodificará el fichero como siempre.
+    """
+    if not decoded_cache.enabled or not processing_pool.idle:
+        return
+    try:
+        nbytes = await run_in_threadpool(_frame_bytes, path)
+        if nbytes >= TILED_MIN_PIXELS * 3:
+            return
+        shm_name = decoded_cache.reserve(name, nbytes)
+        if shm_name is None:
+            return
+        await processing_pool.run(decode_to_shared, path, shm_name, low_priority=True)
+    except PoolBusy:
+        # Los hijos se ocuparon mientras tanto: no se decodifica por adelantado
+        decoded_cache.discard(name)
+        return
+    except Exception as e:
+        logger.debug("Decoded prefetch failed for %s: %s", name, e)
+        decoded_cache.discard(name)
+        return
+    decoded_cache.mark_ready(name, shm_name)
+
+
+# Instancia compartida; el lifespan de la app libera los bloques al parar
+decoded_cache = DecodedCache()
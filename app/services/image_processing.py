@@ -1,35 +1,43 @@
-from PIL import Image
+import os
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from io import BytesIO
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import PIL
+from PIL import ExifTags, Image
 import cv2
 import numpy as np
 
+from app.services import progress
+from app.services.buffer_arena import arena
+
 def adjust_channel_curve_lab(image, clip_limit=1.0):
-    lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(1,10))
-    l = clahe.apply(l)
-    lab = cv2.merge([l, a, b])
-    return cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+    return run_lab_stages(
+        image,
+        [partial(lab_clahe, clip_limit=clip_limit)],
+        to_lab=cv2.COLOR_RGB2LAB,
+        from_lab=cv2.COLOR_LAB2RGB,
+    )
 
 def balance_colors(image, red_factor=0.9, green_factor=1.0, blue_factor=1.2):
-    b, g, r = cv2.split(image)
-    r = np.clip(r * red_factor, 0, 255).astype(np.uint8)
-    g = np.clip(g * green_factor, 0, 255).astype(np.uint8)
-    b = np.clip(b * blue_factor, 0, 255).astype(np.uint8)
-    return cv2.merge([b, g, r])
+    # orden de canales del array: (b, g, r)
+    return apply_channel_luts(image, lut_scale(None, (blue_factor, green_factor, red_factor)))
 
 def clip_histogram(image, r_clip_low=5, r_clip_high=99, g_clip_low=5, g_clip_high=99, b_clip_low=5, b_clip_high=99 ):
-    image = image.astype(np.uint8)
-    b, g, r = cv2.split(image)
-    b = cv2.equalizeHist(b)
-    g = cv2.equalizeHist(g)
-    r = cv2.equalizeHist(r)
-    r_min, r_max = np.percentile(r, [r_clip_low, r_clip_high])
-    r = np.clip(r, r_min, r_max).astype(np.uint8)
-    g_min, g_max = np.percentile(g, [g_clip_low, g_clip_high])
-    g = np.clip(g, g_min, g_max).astype(np.uint8)
-    b_min, b_max = np.percentile(b, [b_clip_low,  b_clip_high])
-    b = np.clip(b, b_min, b_max).astype(np.uint8)
-    return cv2.merge([b, g, r])
+    image = np.asarray(image, dtype=np.uint8)
+    # Percentiles exactos a partir del histograma (un solo conteo para los 3 canales)
+    lut = compile_channel_luts(channel_histograms(image), [
+        lut_equalize,
+        partial(lut_clip_percentiles,
+                low=(b_clip_low, g_clip_low, r_clip_low),
+                high=(b_clip_high, g_clip_high, r_clip_high)),
+    ])
+    return apply_channel_luts(image, lut)
  
 def desaturate_red_and_yellow_lab(image, red_intensity=0.5, yellow_intensity=0.5, yellow_threshold=135):
     """
@@ -40,45 +48,551 @@ def desaturate_red_and_yellow_lab(image, red_intensity=0.5, yellow_intensity=0.5
     :param yellow_threshold: umbral mínimo para considerar que hay amarillo
     :return: imagen corregida
     """
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
+    return run_lab_stages(image, [partial(
+        lab_desaturate_red_and_yellow,
+        red_intensity=red_intensity,
+        yellow_intensity=yellow_intensity,
+        yellow_threshold=yellow_threshold,
+    )])
+
+
+# --- Etapas en espacio LAB ---
+# Una etapa LAB recibe la imagen ya convertida a LAB (HxWx3 uint8) y la
+# modifica in situ; run_lab_stages hace una única conversión de ida y vuelta
+# para todas las etapas de la lista. Con dst=image todo ocurre sobre el mismo
+# buffer.
+LabStage = Callable[[np.ndarray], None]
+
+
+def chroma_luts(red_intensity=0.5, yellow_intensity=0.5, yellow_threshold=135) -> np.ndarray:
+    """LUTs (L, a*, b*) de desaturate_red_and_yellow_lab: dependen solo del valor del píxel."""
+    v = _IDENTITY.astype(np.int16)
 
     # --- Rojo (canal a*) ---
-    a = a.astype(np.int16)
-    red_mask = a > 128
-    a[red_mask] = 128 + ((a[red_mask] - 128) * red_intensity)
-    a = np.clip(a, 0, 255).astype(np.uint8)
+    a = v.copy()
+    red = v > 128
+    a[red] = 128 + ((v[red] - 128) * red_intensity)
 
     # --- Amarillo (canal b*) ---
-    b = b.astype(np.int16)
-    yellow_mask = b > yellow_threshold
-    b[yellow_mask] = yellow_threshold + ((b[yellow_mask] - yellow_threshold) * yellow_intensity)
-    b = np.clip(b, 0, 255).astype(np.uint8)
+    b = v.copy()
+    yellow = v > yellow_threshold
+    b[yellow] = yellow_threshold + ((v[yellow] - yellow_threshold) * yellow_intensity)
+
+    return np.stack([_IDENTITY, np.clip(a, 0, 255), np.clip(b, 0, 255)]).astype(np.uint8)
+
+
+def lab_desaturate_red_and_yellow(lab: np.ndarray, red_intensity=0.5, yellow_intensity=0.5, yellow_threshold=135) -> None:
+    apply_channel_luts(lab, chroma_luts(red_intensity, yellow_intensity, yellow_threshold), dst=lab)
+
+
+def lab_clahe(lab: np.ndarray, clip_limit=1.0) -> None:
+    """CLAHE sobre la luminancia (L)."""
+    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(1,10))
+    cv2.insertChannel(clahe.apply(cv2.extractChannel(lab, 0)), lab, 0)
+
+
+def run_lab_stages(image: np.ndarray, stages: Sequence[LabStage], to_lab=cv2.COLOR_BGR2LAB, from_lab=cv2.COLOR_LAB2BGR, dst=None) -> np.ndarray:
+    """Ejecuta todas las etapas LAB dentro de una sola conversión de color."""
+    lab = cv2.cvtColor(image, to_lab, dst=dst)
+    for stage in stages:
+        stage(lab)
+    return cv2.cvtColor(lab, from_lab, dst=lab)
+
+
+# --- Compilador de etapas por canal a LUT ---
+# Una etapa por canal es una función `hists (3x256) -> luts (3x256 uint8)`:
+# decide su transformación a partir del histograma de cada canal. Como el
+# histograma de la salida de una LUT se obtiene sin tocar la imagen, toda la
+# cadena se compone en una sola LUT y se aplica con un único cv2.LUT.
+ChannelStage = Callable[[np.ndarray], np.ndarray]
+
+_IDENTITY = np.arange(256, dtype=np.uint8)
+# cv2.calcHist devuelve float32: por bandas de < 2^24 píxeles el conteo es exacto
+_HIST_BAND_PIXELS = 1 << 23
+
+
+def channel_histograms(image: np.ndarray) -> np.ndarray:
+    """Histograma exacto (int64, 3x256) de cada canal de una imagen HxWx3 uint8."""
+    hists = np.zeros((3, 256), dtype=np.int64)
+    rows = max(1, _HIST_BAND_PIXELS // max(1, image.shape[1]))
+    for y in range(0, image.shape[0], rows):
+        band = image[y:y + rows]
+        for c in range(3):
+            hists[c] += cv2.calcHist([band], [c], None, [256], [0, 256]).ravel().astype(np.int64)
+    return hists
+
+
+def _map_histograms(hists: np.ndarray, luts: np.ndarray) -> np.ndarray:
+    """Histograma de cada canal tras aplicarle su LUT."""
+    return np.stack([
+        np.bincount(luts[c], weights=hists[c], minlength=256).astype(np.int64)
+        for c in range(3)
+    ])
+
+
+def _hist_percentiles(hists: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """
+    Equivalente exacto de np.percentile(canal, q[c]) (método 'linear') para
+    cada canal, calculado sobre los histogramas (3x256) en O(256).
+    """
+    cdf = np.cumsum(hists, axis=1)
+    n = cdf[:, -1:]
+    virtual = (n - 1) * np.true_divide(q, 100)
+    prev = np.floor(virtual).astype(np.int64)
+    nxt = np.minimum(prev + 1, n - 1)
+    gamma = virtual - prev
+    # valor en la posición k de la muestra ordenada: nº de entradas de la cdf <= k
+    a = (cdf[:, None, :] <= prev[:, :, None]).sum(axis=2).astype(np.float64)
+    b = (cdf[:, None, :] <= nxt[:, :, None]).sum(axis=2).astype(np.float64)
+    # misma interpolación (y mismo redondeo) que numpy
+    diff = b - a
+    out = a + diff * gamma
+    np.subtract(b, diff * (1 - gamma), out=out, where=gamma >= 0.5)
+    return out
+
+
+def lut_invert(hists: np.ndarray) -> np.ndarray:
+    """Negativo -> positivo (equivale a Image.eval(img, lambda x: 255 - x))."""
+    return np.tile(255 - _IDENTITY, (3, 1))
+
+
+def lut_equalize(hists: np.ndarray) -> np.ndarray:
+    """LUT de cv2.equalizeHist para cada canal (misma aritmética float32)."""
+    luts = np.tile(_IDENTITY, (3, 1))
+    for c in range(3):
+        nonzero = np.flatnonzero(hists[c])
+        if not len(nonzero):
+            continue
+        i = nonzero[0]
+        total = int(hists[c].sum())
+        if hists[c][i] == total:
+            # canal constante: OpenCV deja todo el canal en `i`
+            luts[c][:] = i
+            continue
+        scale = np.float32(255.0) / np.float32(total - hists[c][i])
+        acc = np.cumsum(hists[c][i + 1:]).astype(np.float32) * scale
+        luts[c][i] = 0
+        luts[c][i + 1:] = np.clip(np.rint(acc), 0, 255)
+    return luts
+
+
+def lut_clip_percentiles(hists: np.ndarray, low: Sequence[float], high: Sequence[float]) -> np.ndarray:
+    """Recorte de cada canal entre sus percentiles `low` y `high`."""
+    bounds = _hist_percentiles(hists, np.column_stack([low, high]))
+    return np.clip(_IDENTITY, bounds[:, :1], bounds[:, 1:]).astype(np.uint8)
+
+
+def lut_normalize(hists: np.ndarray, alpha: float = 0, beta: float = 255) -> np.ndarray:
+    """Equivale a cv2.normalize(img, None, alpha, beta, cv2.NORM_MINMAX) (min/max global)."""
+    present = np.flatnonzero(hists.sum(axis=0))
+    if not len(present):
+        return np.tile(_IDENTITY, (3, 1))
+    # La LUT se obtiene normalizando una rampa con el mismo mínimo y máximo,
+    # así se reutiliza exactamente la aritmética de OpenCV
+    ramp = np.clip(_IDENTITY, present[0], present[-1]).astype(np.uint8).reshape(1, 256)
+    lut = cv2.normalize(ramp, None, alpha, beta, cv2.NORM_MINMAX).ravel()
+    return np.tile(lut, (3, 1))
+
+
+def lut_scale(hists: np.ndarray, factors: Sequence[float]) -> np.ndarray:
+    """Multiplica cada canal por su factor, con saturación (como balance_colors)."""
+    return np.stack([np.clip(_IDENTITY * f, 0, 255).astype(np.uint8) for f in factors])
+
+
+def compile_channel_luts(hists: np.ndarray, stages: Sequence[ChannelStage]) -> np.ndarray:
+    """Compone las etapas en una única LUT por canal (3x256 uint8)."""
+    lut = np.tile(_IDENTITY, (3, 1))
+    for stage in stages:
+        stage_lut = stage(hists)
+        lut = np.take_along_axis(stage_lut, lut.astype(np.intp), axis=1)
+        hists = _map_histograms(hists, stage_lut)
+    return lut
+
+
+def apply_channel_luts(image: np.ndarray, luts: np.ndarray, dst=None) -> np.ndarray:
+    """Aplica una LUT distinta a cada canal en una sola pasada."""
+    table = np.ascontiguousarray(luts.T).reshape(256, 1, 3)
+    return cv2.LUT(image, table, dst=dst)
+
+
+def _read_pixels(img: Image.Image, dst: np.ndarray) -> np.ndarray:
+    """
+    Copia los píxeles de `img` a `dst` por bloques. np.asarray(img) pasaría
+    por tobytes(), que arma la imagen completa en bytes (y la duplica al unir
+    los trozos) antes de copiarla.
+    """
+    img.load()
+    encoder = Image._getencoder(img.mode, "raw", img.mode)
+    encoder.setimage(img.im, (0, 0) + img.size)
+    out = memoryview(dst.reshape(-1))
+    bufsize = max(1 << 20, img.size[0] * 4)
+    pos = 0
+    while True:
+        _, errcode, chunk = encoder.encode(bufsize)
+        out[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+        if errcode:
+            break
+    if errcode < 0:
+        raise RuntimeError(f"encoder error {errcode} reading pixels")
+    return dst
+
+
+# --- Pipeline por defecto ---
+# Estadísticas globales -> LUT por canal; todo lo demás es por píxel.
+def pipeline_luts(hists: np.ndarray) -> np.ndarray:
+    """Inversión + recorte del histograma + normalización + balance de color en una LUT."""
+    return compile_channel_luts(hists, [
+        lut_invert,
+        lut_equalize,
+        partial(lut_clip_percentiles, low=(5, 5, 5), high=(99, 99, 99)),
+        partial(lut_normalize, alpha=0, beta=245),
+        # orden de canales del array: (b, g, r) según balance_colors
+        partial(lut_scale, factors=(1.0, 0.85, 0.9)),
+    ])
+
+
+# Reducir saturación del rojo y del amarillo (todas las etapas LAB en una conversión)
+PIPELINE_LAB_STAGES: List[LabStage] = [
+    partial(lab_desaturate_red_and_yellow, red_intensity=0.6, yellow_intensity=0.9, yellow_threshold=100),
+]
+
+
+def finish_frame(frame: np.ndarray, lut: np.ndarray, to_lab=cv2.COLOR_BGR2LAB, from_lab=cv2.COLOR_LAB2BGR) -> np.ndarray:
+    """Parte por píxel del pipeline, in situ: LUT por canal + etapas LAB."""
+    apply_channel_luts(frame, lut, dst=frame)
+    return run_lab_stages(frame, PIPELINE_LAB_STAGES, to_lab=to_lab, from_lab=from_lab, dst=frame)
+
+
+# --- Paralelismo dentro de una imagen (bandas de filas) ---
+# Nº de bandas por defecto; 1 = todo en el hilo actual
+PROCESS_BANDS: int = int(os.getenv("PROCESS_BANDS", "1"))
+_band_executor: Optional[ThreadPoolExecutor] = None
+_band_workers: int = 0
+
+
+def _band_slices(height: int, bands: int) -> List[slice]:
+    bands = max(1, min(bands, height))
+    edges = np.linspace(0, height, bands + 1).astype(int)
+    return [slice(a, b) for a, b in zip(edges[:-1], edges[1:])]
+
+
+def _map_bands(fn: Callable[[np.ndarray], object], frame: np.ndarray, bands: int) -> list:
+    """Aplica `fn` a cada banda de filas de `frame` (vistas, sin copia) en paralelo."""
+    slices = _band_slices(frame.shape[0], bands)
+    if len(slices) == 1:
+        return [fn(frame)]
+    global _band_executor, _band_workers
+    if _band_workers < len(slices):
+        # OpenCV y NumPy liberan el GIL: los hilos escalan con los núcleos
+        if _band_executor is not None:
+            _band_executor.shutdown(wait=False)
+        _band_executor = ThreadPoolExecutor(max_workers=len(slices), thread_name_prefix="band")
+        _band_workers = len(slices)
+    return list(_band_executor.map(lambda s: fn(frame[s]), slices))
+
+
+# --- Estadísticas sobre un proxy de baja resolución ---
+# Las estadísticas globales (CDF de la ecualización, percentiles, min/max) casi
+# no cambian si se calculan sobre una submuestra de ~1.5 MP; la LUT resultante
+# se aplica igualmente a resolución completa. 0 = desactivado.
+PROXY_MIN_PIXELS: int = int(os.getenv("PROXY_MIN_PIXELS", "0"))
+PROXY_TARGET_PIXELS: int = int(os.getenv("PROXY_TARGET_PIXELS", str(1_500_000)))
+
+
+def proxy_step(height: int, width: int, target_pixels: int = PROXY_TARGET_PIXELS) -> int:
+    """Paso de submuestreo (en filas y columnas) para quedar en ~target_pixels."""
+    return max(1, int(np.ceil(np.sqrt(height * width / max(1, target_pixels)))))
+
+
+def _stats_step(height: int, width: int) -> int:
+    if PROXY_MIN_PIXELS and height * width >= PROXY_MIN_PIXELS:
+        return proxy_step(height, width)
+    return 1
+
+
+def proxy_histograms(frame: np.ndarray, step: int) -> np.ndarray:
+    return channel_histograms(np.ascontiguousarray(frame[::step, ::step]))
+
+
+def proxy_tolerance_report(frame: np.ndarray, target_pixels: int = PROXY_TARGET_PIXELS) -> Dict[str, float]:
+    """
+    Compara la LUT calculada sobre el proxy con la exacta. Como la diferencia
+    solo depende del valor de cada píxel, se mide exactamente con el histograma
+    completo (antes de las etapas LAB) sin procesar la imagen dos veces.
+    """
+    step = proxy_step(frame.shape[0], frame.shape[1], target_pixels)
+    hists = channel_histograms(frame)
+    exact = pipeline_luts(hists).astype(np.int16)
+    proxy = pipeline_luts(proxy_histograms(frame, step)).astype(np.int16)
+    diff = np.abs(exact - proxy)
+    total = hists.sum()
+    return {
+        "step": step,
+        "proxy_pixels": int(np.ceil(frame.shape[0] / step) * np.ceil(frame.shape[1] / step)),
+        "max_abs_diff": int(diff[hists > 0].max(initial=0)),
+        "mean_abs_diff": float((hists * diff).sum() / total),
+        "changed_fraction": float((hists * (diff > 0)).sum() / total),
+    }
+
+
+def process_frame(frame: np.ndarray, bands: int = PROCESS_BANDS, stats_step: int = 1) -> np.ndarray:
+    """
+    Ejecuta el pipeline sobre `frame` (HxWx3 uint8, in situ). Con bands > 1 las
+    estadísticas se reducen por bandas y la parte por píxel se reparte en hilos.
+    Con stats_step > 1 las estadísticas salen del proxy frame[::step, ::step].
+    """
+    progress.report("statistics", 0.3)
+    if stats_step > 1:
+        hists = proxy_histograms(frame, stats_step)
+    else:
+        hists = sum(_map_bands(channel_histograms, frame, bands))
+    lut = pipeline_luts(hists)
+    progress.report("transform", 0.5)
+    _map_bands(partial(finish_frame, lut=lut), frame, bands)
+    return frame
+
+
+@contextmanager
+def _atomic_output(output_path: str) -> Iterator[str]:
+    """
+    Ruta temporal junto a `output_path` que se renombra al terminar: nadie ve
+    nunca un fichero a medio escribir. Conserva la extensión (formato de salida).
+    """
+    root, ext = os.path.splitext(output_path)
+    tmp_path = f"{root}.tmp{os.getpid()}{ext}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# --- Modo por teselas para escaneos muy grandes ---
+# A partir de TILED_MIN_PIXELS la imagen se decodifica directamente a un
+# np.memmap en disco y se procesa en dos pasadas por bloques de filas: la
+# primera suma los histogramas de cada bloque y la segunda aplica la
+# transformación. Solo el bloque en curso necesita estar en RAM.
+TILED_MIN_PIXELS: int = int(os.getenv("TILED_MIN_PIXELS", str(60_000_000)))
+TILED_MEMORY_BUDGET: int = int(os.getenv("TILED_MEMORY_BUDGET", str(256 * 1024 * 1024)))
+TILED_SCRATCH_DIR: Optional[str] = os.getenv("TILED_SCRATCH_DIR") or None
+TILED_JPEG_QUALITY: int = 75  # mismo valor por defecto que Pillow
+
+
+def _tile_slices(height: int, width: int, memory_budget: int) -> List[slice]:
+    # bloque + su conversión LAB + margen para los intermedios de OpenCV
+    rows = max(1, memory_budget // max(1, width * 3 * 3))
+    return [slice(y, min(y + rows, height)) for y in range(0, height, rows)]
+
+
+def process_image_tiled(image_path: str, output_path: str, memory_budget: int = TILED_MEMORY_BUDGET,
+                        scratch_dir: Optional[str] = TILED_SCRATCH_DIR, stats_step: int = 1) -> Dict[str, int]:
+    """
+    Igual que process_image pero con memoria acotada por `memory_budget`
+    (más la caché de páginas del SO, que el kernel puede liberar).
+    OpenCV decodifica en orden BGR, así que las LUT se invierten de canal y
+    las etapas LAB usan la conversión RGB: el resultado es el mismo.
+    """
+    with Image.open(image_path) as img:
+        width, height = img.size  # solo lee la cabecera
+
+    shape = (height, width, 3)
+    row_bytes = width * 3
+
+    with tempfile.NamedTemporaryFile(dir=scratch_dir, prefix="tiles_", suffix=".raw") as scratch:
+        def tile(rows: slice, mode: str) -> np.memmap:
+            # Cada tesela se mapea por separado: al soltarla deja de contar en el RSS
+            return np.memmap(scratch, dtype=np.uint8, mode=mode, offset=rows.start * row_bytes,
+                             shape=(rows.stop - rows.start, width, 3))
+
+        frame = np.memmap(scratch, dtype=np.uint8, mode="w+", shape=shape)
+        decoded = cv2.imread(image_path, frame, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if decoded is None or decoded.shape != shape:
+            raise ValueError(f"Cannot decode {image_path}")
+        if not np.shares_memory(decoded, frame):
+            np.copyto(frame, decoded)
+        frame.flush()
+        del frame, decoded
+        tiles = _tile_slices(height, width, memory_budget)
+        progress.report("statistics", 0.3)
+
+        # Pasada 1: histogramas por tesela (se suman); con proxy solo se
+        # cuentan las filas/columnas múltiplo de stats_step
+        hists = np.zeros((3, 256), dtype=np.int64)
+        for rows in tiles:
+            first = -rows.start % stats_step
+            if first < rows.stop - rows.start:
+                hists += proxy_histograms(tile(rows, "r")[first:], stats_step)
+        lut = pipeline_luts(hists[::-1])[::-1]
+
+        # Pasada 2: transformación por tesela, volcando a disco tras cada una
+        for i, rows in enumerate(tiles):
+            progress.report("transform", 0.5 + 0.35 * i / len(tiles))
+            block = tile(rows, "r+")
+            finish_frame(block, lut, to_lab=cv2.COLOR_RGB2LAB, from_lab=cv2.COLOR_LAB2RGB)
+            block.flush()
+            del block
+
+        params = []
+        if output_path.lower().endswith((".jpg", ".jpeg")):
+            params = [cv2.IMWRITE_JPEG_QUALITY, TILED_JPEG_QUALITY]
+        progress.report("encode", 0.85)
+        with _atomic_output(output_path) as tmp_path:
+            if not cv2.imwrite(tmp_path, np.memmap(scratch, dtype=np.uint8, mode="r", shape=shape), params):
+                raise ValueError(f"Cannot write {output_path}")
+        scratch_bytes = height * row_bytes
+
+    return {"tiled_images": 1, "tiled_scratch_bytes": scratch_bytes, "proxy_images": int(stats_step > 1)}
+
+
+@lru_cache(maxsize=None)
+def pipeline_fingerprint() -> str:
+    """
+    Huella de todo lo que determina la salida de process_image: el código de
+    este módulo, las versiones de OpenCV/NumPy/Pillow y la configuración que
+    cambia píxeles o codificación. Si cambia, la caché de resultados se invalida.
+    """
+    h = hashlib.sha256()
+    with open(__file__, "rb") as f:
+        h.update(f.read())
+    for part in (cv2.__version__, np.__version__, PIL.__version__,
+                 PROXY_MIN_PIXELS, PROXY_TARGET_PIXELS, TILED_MIN_PIXELS, TILED_JPEG_QUALITY):
+        h.update(str(part).encode())
+    return h.hexdigest()[:16]
+
+
+# --- Imágenes ya decodificadas (memoria compartida) ---
+# El proceso principal reserva el bloque (app/services/decoded_cache.py); un
+# hijo del pool decodifica en él tras la subida y /process/ lo copia en vez de
+# leer y decodificar el fichero otra vez.
+def decode_to_shared(image_path: str, shm_name: str) -> None:
+    """Decodifica `image_path` (RGB HxWx3 uint8) en el bloque compartido `shm_name`."""
+    img = Image.open(image_path)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        frame = np.ndarray((img.size[1], img.size[0], 3), np.uint8, buffer=shm.buf)
+        _read_pixels(img, frame)
+        del frame
+    finally:
+        shm.close()
+
+
+def _copy_from_shared(shm_name: str, dst: np.ndarray) -> bool:
+    """Copia a `dst` la imagen del bloque `shm_name`; False si ya no existe."""
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name)
+    except FileNotFoundError:  # expulsado de la caché entre medias
+        return False
+    try:
+        if shm.size < dst.nbytes:
+            return False
+        src = np.ndarray(dst.shape, np.uint8, buffer=shm.buf)
+        np.copyto(dst, src)
+        del src
+        return True
+    finally:
+        shm.close()
+
+
+def process_image(image_path: str, output_path: str, bands: int = PROCESS_BANDS,
+                  decoded: Optional[str] = None, task_id: Optional[str] = None) -> Dict[str, int]:
+    """
+    Procesa el negativo `image_path` y guarda el positivo en `output_path`.
+    `decoded`: bloque compartido con la imagen ya decodificada, si lo hay.
+    `task_id`: si se indica, se informa del progreso por etapas (app/services/progress.py).
+    Devuelve métricas de la ejecución (bytes de buffers nuevos vs reutilizados).
+    """
+    with progress.tracking(task_id):
+        progress.report("decode", 0.0)
+        return _process_image(image_path, output_path, bands, decoded)
+
+
+def _process_image(image_path: str, output_path: str, bands: int, decoded: Optional[str]) -> Dict[str, int]:
+    # La imagen viaja como un único buffer HxWx3 uint8 desde la decodificación
+    # hasta la codificación: cada etapa escribe sobre él (dst=), sin separar
+    # ni volver a intercalar canales. El buffer sale de la arena del proceso.
+    img = Image.open(image_path)
+    stats_step = _stats_step(img.size[1], img.size[0])
+    if img.size[0] * img.size[1] >= TILED_MIN_PIXELS:
+        img.close()
+        return process_image_tiled(image_path, output_path, stats_step=stats_step)
+
+    with arena.request():
+        frame = arena.take((img.size[1], img.size[0], 3))
+        from_shared = decoded is not None and _copy_from_shared(decoded, frame)
+        if not from_shared:
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            _read_pixels(img, frame)
+        img.close()
+        del img
+
+        process_frame(frame, bands, stats_step)
 
-    lab_modified = cv2.merge([l, a, b])
-    result = cv2.cvtColor(lab_modified, cv2.COLOR_LAB2BGR)
-    return result
+        # Guardar imagen
+        progress.report("encode", 0.85)
+        with _atomic_output(output_path) as tmp_path:
+            Image.fromarray(frame).save(tmp_path)
 
+    return {
+        "arena_allocated_bytes": arena.allocated_bytes,
+        "arena_reused_bytes": arena.reused_bytes,
+        "proxy_images": int(stats_step > 1),
+        "decoded_cache_used": int(from_shared),
+    }
 
-def process_image(image_path: str, output_path: str):
-    img = Image.open(image_path).convert('RGB')
-    inverted_img = Image.eval(img, lambda x: 255 - x)
-    na = np.array(inverted_img, dtype=np.uint8)
 
-    # Aplicar recorte del histograma
-    clipped = clip_histogram(na)
+# --- Vista previa rápida ---
+# Decodifica a 1/2, 1/4 o 1/8 de resolución (JPEG: escalado DCT de libjpeg vía
+# draft(), sin decodificar la imagen completa) y ejecuta el mismo pipeline.
+PREVIEW_SCALES = (1, 2, 4, 8)
+PREVIEW_JPEG_QUALITY: int = 80
 
 
-    # Normalizar
-    normalized = cv2.normalize(clipped, None, 0, 245, cv2.NORM_MINMAX)
+def _exif_thumbnail(img: Image.Image) -> Optional[Image.Image]:
+    """Miniatura JPEG embebida en el EXIF (IFD1) que guardan muchos escáneres y cámaras."""
+    raw = img.info.get("exif")
+    if not raw:
+        return None
+    try:
+        ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset, length = ifd1.get(0x0201), ifd1.get(0x0202)  # JPEGInterchangeFormat(Length)
+        if not offset or not length:
+            return None
+        start = offset + (6 if raw.startswith(b"Exif\x00\x00") else 0)
+        thumb = Image.open(BytesIO(raw[start:start + length]))
+        thumb.load()
+        return thumb
+    except Exception:
+        return None
 
-    # Balancear colores
-    balanced = balance_colors(normalized, red_factor=0.9, green_factor=0.85, blue_factor=1.0)
 
-    # Reducir saturación del rojo
-    ajustada = desaturate_red_and_yellow_lab(balanced, red_intensity=0.6, yellow_intensity=0.9, yellow_threshold=100)
+def decode_preview(image_path: str, scale: int = 4, use_thumbnail: bool = False) -> Image.Image:
+    img = Image.open(image_path)
+    if use_thumbnail:
+        thumb = _exif_thumbnail(img)
+        if thumb is not None:
+            return thumb if thumb.mode == 'RGB' else thumb.convert('RGB')
+    if scale > 1:
+        if img.format == 'JPEG':
+            img.draft('RGB', (img.size[0] // scale, img.size[1] // scale))
+        else:
+            # reduce() no admite todos los modos (paleta, 1 bit, 16 bits): antes a RGB
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img = img.reduce(scale)
+    return img if img.mode == 'RGB' else img.convert('RGB')
 
 
-    # Guardar imagen
-    processed_img = Image.fromarray(ajustada.astype(np.uint8))
-    processed_img.save(output_path)
+def process_preview(image_path: str, scale: int = 4, use_thumbnail: bool = False) -> bytes:
+    """Procesa una versión reducida de `image_path` y devuelve el JPEG resultante."""
+    if scale not in PREVIEW_SCALES:
+        raise ValueError(f"scale must be one of {PREVIEW_SCALES}")
+    frame = np.array(decode_preview(image_path, scale, use_thumbnail), dtype=np.uint8)
+    process_frame(frame, bands=1)
+    out = BytesIO()
+    Image.fromarray(frame).save(out, format='JPEG', quality=PREVIEW_JPEG_QUALITY)
+    return out.getvalue()
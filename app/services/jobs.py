@@ -0,0 +1,181 @@
+import os
+import time
+import uuid
+import asyncio
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.services.worker_pool import PROCESS_WORKERS, PoolSaturated, processing_pool
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración (variables de entorno)
+# Trabajos que pueden estar pidiendo turno al planificador a la vez
+JOB_CONCURRENCY: int = int(os.getenv("JOB_CONCURRENCY", str(PROCESS_WORKERS * 2)))
+JOB_QUEUE_SIZE: int = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RETENTION_SECONDS: int = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+# Prioridades: menor número = antes
+JOB_PRIORITY_MIN: int = 0
+JOB_PRIORITY_MAX: int = 9
+JOB_PRIORITY_DEFAULT: int = 5
+
+
+class JobQueueFull(Exception):
+    """Hay demasiados trabajos en espera; el cliente debe reintentar más tarde."""
+
+
+class Job:
+    """Estado de un trabajo; cada cambio incrementa `version` y despierta a quien espera."""
+
+    def __init__(self, filename: str, priority: int):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.priority = priority
+        self.status = "queued"  # queued | running | done | error
+        self.stage = "queued"
+        self.progress = 0.0
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.version = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "error")
+
+    def update(self, **fields: Any) -> None:
+        for name, value in fields.items():
+            setattr(self, name, value)
+        if self.done and self.finished is None:
+            self.finished = time.time()
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_change(self, version: int, timeout: float) -> bool:
+        """Espera a que `version` quede atrás; False si vence `timeout`."""
+        if self.version != version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "priority": self.priority,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+JobFn = Callable[[Job], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class JobQueue:
+    """
+    Cola de prioridad en el propio proceso: `concurrency` tareas del event loop
+    consumen los trabajos (menor prioridad primero; a igual prioridad los
+    clientes se turnan en vez de ir en orden de llegada). El turno real en el
+    pool lo da el planificador (app/services/scheduler.py). El progreso por
+    etapas llega desde los hijos del pool (ProcessingPool.progress_handler).
+    """
+
+    def __init__(self, concurrency: int = JOB_CONCURRENCY, max_queued: int = JOB_QUEUE_SIZE,
+                 retention: int = JOB_RETENTION_SECONDS):
+        self.concurrency = max(1, concurrency)
+        self.max_queued = max_queued
+        self.retention = retention
+        self._jobs: Dict[str, Job] = {}
+        self._seq = itertools.count()
+        # Reloj virtual por prioridad y último turno asignado a cada (prioridad, cliente)
+        self._vtime: Dict[int, float] = {}
+        self._finish: Dict[Tuple[int, str], float] = {}
+        self._queue: Optional["asyncio.PriorityQueue[Any]"] = None
+        self._runners: List["asyncio.Task[None]"] = []
+
+    def start(self) -> None:
+        if self._runners:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._runners = [asyncio.ensure_future(self._run()) for _ in range(self.concurrency)]
+        processing_pool.progress_handler = self.progress
+
+    async def stop(self) -> None:
+        runners, self._runners = self._runners, []
+        for task in runners:
+            task.cancel()
+        await asyncio.gather(*runners, return_exceptions=True)
+        processing_pool.progress_handler = None
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def _purge(self) -> None:
+        limit = time.time() - self.retention
+        for job_id in [j.id for j in self._jobs.values() if j.finished is not None and j.finished < limit]:
+            del self._jobs[job_id]
+        for key in [k for k, f in self._finish.items() if f <= self._vtime.get(k[0], 0.0)]:
+            del self._finish[key]
+
+    def submit(self, fn: JobFn, filename: str, priority: int = JOB_PRIORITY_DEFAULT, client: str = "") -> Job:
+        if self._queue is None:
+            raise RuntimeError("Job queue is not started")
+        if self.queued >= self.max_queued:
+            raise JobQueueFull()
+        self._purge()
+        job = Job(filename, priority)
+        self._jobs[job.id] = job
+        tag = max(self._vtime.get(priority, 0.0), self._finish.get((priority, client), 0.0))
+        self._finish[(priority, client)] = tag + 1.0
+        self._queue.put_nowait((priority, tag, next(self._seq), job, fn))
+        metrics.incr("jobs_submitted")
+        return job
+
+    def progress(self, task_id: str, stage: str, fraction: float) -> None:
+        job = self._jobs.get(task_id)
+        if job is not None and job.status == "running":
+            job.update(stage=stage, progress=fraction)
+
+    async def _run(self) -> None:
+        while True:
+            priority, tag, _, job, fn = await self._queue.get()
+            self._vtime[priority] = max(self._vtime.get(priority, 0.0), tag)
+            job.update(status="running", stage="starting")
+            while True:
+                try:
+                    result = await fn(job)
+                except PoolSaturated as e:
+                    # Pool lleno por peticiones directas: el trabajo espera, no falla
+                    job.update(stage="waiting")
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("Job %s failed: %s", job.id, e)
+                    job.update(status="error", stage="error", error=str(getattr(e, "detail", "") or e))
+                    metrics.incr("jobs_failed")
+                else:
+                    job.update(status="done", stage="done", progress=1.0, result=result)
+                    metrics.incr("jobs_completed")
+                break
+
+
+# Instancia compartida; la arranca/detiene el lifespan de la app (main.py)
+job_queue = JobQueue()
@@ -0,0 +1,30 @@
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+# Progreso por etapas desde los hijos del pool hacia el proceso principal.
+# El inicializador del pool instala la cola (ver worker_pool.py); fuera de un
+# hijo del pool, o sin tarea en seguimiento, report() no hace nada.
+_queue: Optional[Any] = None
+_task_id: Optional[str] = None
+
+
+def install(queue: Optional[Any]) -> None:
+    global _queue
+    _queue = queue
+
+
+@contextmanager
+def tracking(task_id: Optional[str]) -> Iterator[None]:
+    """Asocia los report() del bloque a la tarea `task_id`."""
+    global _task_id
+    previous, _task_id = _task_id, task_id
+    try:
+        yield
+    finally:
+        _task_id = previous
+
+
+def report(stage: str, fraction: float) -> None:
+    """Etapa en curso y fracción completada (0..1) de la tarea en seguimiento."""
+    if _queue is not None and _task_id is not None:
+        _queue.put_nowait((_task_id, stage, fraction))
@@ -0,0 +1,63 @@
+import os
+import json
+import hashlib
+from typing import Any, Dict, Optional
+
+from app.services.image_processing import pipeline_fingerprint
+from app.utils import metrics
+from app.utils.blob_store import blob_store, file_digest
+from app.utils.catalog import catalog
+
+# Nombres de la caché de resultados: processed/.cache/<clave>.jpg
+RESULT_CACHE_FOLDER: str = os.path.join("processed", ".cache")
+
+
+def cache_key(content_digest: str, params: Dict[str, Any]) -> str:
+    """Clave = hash del contenido + parámetros + versión del pipeline."""
+    payload = json.dumps(
+        {"content": content_digest, "params": params, "pipeline": pipeline_fingerprint()},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Caché de resultados de process_image. Cada entrada es un alias
+    `processed/.cache/<clave>.jpg` del blob con el resultado (ver
+    app/utils/blob_store.py), así que un acierto no decodifica, copia ni
+    escribe nada en disco: solo apunta el nombre de salida al mismo blob.
+    Caducan con el resto de nombres (ver app/utils/cleanup.py), contando
+    desde el último acierto.
+    """
+
+    def __init__(self, folder: str = RESULT_CACHE_FOLDER):
+        self.folder = folder
+
+    def _alias(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.jpg")
+
+    def fetch(self, key: str, output_alias: str, **meta: Any) -> Optional[str]:
+        """Si hay resultado para `key`, apunta `output_alias` a él y devuelve el SHA-256 del blob."""
+        entry = catalog.get(self._alias(key))
+        digest = blob_store.alias(output_alias, entry["sha256"], **meta) if entry is not None else None
+        if digest is None:
+            metrics.incr("result_cache_misses")
+            return None
+        # Un acierto es un uso: la entrada vuelve a contar desde ahora
+        catalog.refresh(self._alias(key))
+        metrics.incr("result_cache_hits")
+        return digest
+
+    def store(self, key: str, result_path: str, output_alias: str, **meta: Any) -> str:
+        """
+        Guarda el fichero recién generado `result_path` como `output_alias` y
+        como entrada de `key`; devuelve el SHA-256 del blob.
+        """
+        digest = file_digest(result_path)
+        blob_store.ingest(result_path, output_alias, digest, **meta)
+        blob_store.alias(self._alias(key), digest, source=output_alias)
+        return digest
+
+
+result_cache = ResultCache()
@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional
+
+from app.services.worker_pool import PROCESS_QUEUE_SIZE, PROCESS_RETRY_AFTER_SECONDS, PROCESS_WORKERS, PoolSaturated
+from app.utils import metrics
+
+# Configuración (variables de entorno)
+SCHED_SLOTS: int = int(os.getenv("SCHED_SLOTS", str(PROCESS_WORKERS)))
+SCHED_MAX_PER_CLIENT: int = int(os.getenv("SCHED_MAX_PER_CLIENT", "2"))
+SCHED_MAX_QUEUED_PER_CLIENT: int = int(os.getenv("SCHED_MAX_QUEUED_PER_CLIENT", "32"))
+SCHED_INTERACTIVE_RESERVED: int = int(os.getenv("SCHED_INTERACTIVE_RESERVED", "1"))
+SCHED_INTERACTIVE_WEIGHT: int = int(os.getenv("SCHED_INTERACTIVE_WEIGHT", "4"))
+
+# Carriles: lo que un usuario espera con la página abierta vs trabajos en segundo plano
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+LANES = (LANE_INTERACTIVE, LANE_BATCH)
+
+_WAIT_SAMPLES = 512
+
+
+class ClientQueueFull(PoolSaturated):
+    """El cliente ya tiene demasiadas peticiones esperando turno."""
+
+
+class _Waiter:
+    __slots__ = ("client", "lane", "tag", "future", "since")
+
+    def __init__(self, client: str, lane: str, tag: float, future: "asyncio.Future[None]"):
+        self.client = client
+        self.lane = lane
+        self.tag = tag
+        self.future = future
+        self.since = time.monotonic()
+
+
+class FairScheduler:
+    """
+    Reparte los `slots` de procesado (uno por hijo del pool) entre peticiones:
+    - Dos carriles: `interactive` y `batch`. Entre carriles se alterna por
+      pesos (stride scheduling) y `interactive_reserved` slots quedan siempre
+      libres para el carril interactivo, así que un lote grande nunca ocupa
+      todos los procesos.
+    - Dentro de cada carril, cola justa por cliente (start-time fair queuing):
+      cada cliente avanza su propio reloj virtual y se atiende primero la
+      etiqueta más baja, de modo que 36 fotos de un cliente se intercalan con
+      la única foto de otro en vez de ir todas delante.
+    - Como mucho `max_per_client` trabajos a la vez por cliente.
+    - Como mucho `slots + max_queue` peticiones admitidas entre todos los
+      clientes (en curso o esperando); con más, PoolSaturated (HTTP 503).
+    """
+
+    def __init__(
+        self,
+        slots: int = SCHED_SLOTS,
+        max_per_client: int = SCHED_MAX_PER_CLIENT,
+        max_queued_per_client: int = SCHED_MAX_QUEUED_PER_CLIENT,
+        max_queue: int = PROCESS_QUEUE_SIZE,
+        interactive_reserved: int = SCHED_INTERACTIVE_RESERVED,
+        interactive_weight: int = SCHED_INTERACTIVE_WEIGHT,
+        retry_after: int = PROCESS_RETRY_AFTER_SECONDS,
+    ):
+        self.slots = max(1, slots)
+        self.max_per_client = max(1, max_per_client)
+        self.max_queued_per_client = max_queued_per_client
+        self.max_queue = max(0, max_queue)
+        self.interactive_reserved = max(0, min(interactive_reserved, self.slots - 1))
+        self.retry_after = retry_after
+        self._stride = {LANE_INTERACTIVE: 1.0 / max(1, interactive_weight), LANE_BATCH: 1.0}
+        self._pass = {lane: 0.0 for lane in LANES}
+        self._vtime = {lane: 0.0 for lane in LANES}
+        self._finish: Dict[str, Dict[str, float]] = {lane: {} for lane in LANES}
+        self._queues: Dict[str, Dict[str, Deque[_Waiter]]] = {lane: {} for lane in LANES}
+        self._running = 0
+        self._running_by_lane = {lane: 0 for lane in LANES}
+        self._running_by_client: Dict[str, int] = {}
+        self._waits: Dict[str, Deque[float]] = {lane: deque(maxlen=_WAIT_SAMPLES) for lane in LANES}
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def queued(self, lane: str) -> int:
+        return sum(len(q) for q in self._queues[lane].values())
+
+    @asynccontextmanager
+    async def slot(self, client: str, lane: str = LANE_INTERACTIVE) -> AsyncIterator[None]:
+        """Espera turno para `client` en `lane` y ocupa un slot mientras dura el bloque."""
+        await self._acquire(client, lane)
+        try:
+            yield
+        finally:
+            self._release(client, lane)
+
+    async def _acquire(self, client: str, lane: str) -> None:
+        queues = self._queues[lane]
+        queued = sum(len(q) for ln in LANES for c, q in self._queues[ln].items() if c == client)
+        if queued >= self.max_queued_per_client:
+            metrics.incr("sched_rejected")
+            raise ClientQueueFull(self.retry_after)
+        if self._running + sum(self.queued(ln) for ln in LANES) >= self.slots + self.max_queue:
+            metrics.incr("sched_saturated")
+            raise PoolSaturated(self.retry_after)
+
+        if not queues:
+            # Carril que vuelve a tener trabajo: no acumula "crédito" del tiempo ocioso
+            busy = [self._pass[ln] for ln in LANES if ln != lane and self._queues[ln]]
+            self._pass[lane] = max([self._pass[lane]] + busy)
+
+        # Etiqueta de inicio (SFQ): no antes del reloj del carril ni del último trabajo del cliente
+        tag = max(self._vtime[lane], self._finish[lane].get(client, 0.0))
+        self._finish[lane][client] = tag + 1.0
+        waiter = _Waiter(client, lane, tag, asyncio.get_running_loop().create_future())
+        queues.setdefault(client, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(client, lane)  # el turno llegó a la vez que la cancelación
+            else:
+                self._remove(waiter)
+            raise
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues[waiter.lane].get(waiter.client)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.lane][waiter.client]
+
+    def _release(self, client: str, lane: str) -> None:
+        self._running -= 1
+        self._running_by_lane[lane] -= 1
+        left = self._running_by_client[client] - 1
+        if left:
+            self._running_by_client[client] = left
+        else:
+            del self._running_by_client[client]
+        self._dispatch()
+
+    def _head(self, lane: str) -> Optional[_Waiter]:
+        """Primer turno del carril entre los clientes que no han llegado a su límite."""
+        best: Optional[_Waiter] = None
+        for client, queue in self._queues[lane].items():
+            if self._running_by_client.get(client, 0) >= self.max_per_client:
+                continue
+            if best is None or queue[0].tag < best.tag:
+                best = queue[0]
+        return best
+
+    def _dispatch(self) -> None:
+        while self._running < self.slots:
+            candidates: List[_Waiter] = []
+            for lane in LANES:
+                if lane == LANE_BATCH and self._running_by_lane[lane] >= self.slots - self.interactive_reserved:
+                    continue
+                head = self._head(lane)
+                if head is not None:
+                    candidates.append(head)
+            if not candidates:
+                return
+            waiter = min(candidates, key=lambda w: (self._pass[w.lane], w.lane != LANE_INTERACTIVE))
+            self._pass[waiter.lane] += self._stride[waiter.lane]
+            self._vtime[waiter.lane] = waiter.tag
+            self._remove(waiter)
+            self._forget_idle(waiter.lane)
+            if waiter.future.done():  # cancelado, aún sin procesar la cancelación
+                continue
+
+            self._running += 1
+            self._running_by_lane[waiter.lane] += 1
+            self._running_by_client[waiter.client] = self._running_by_client.get(waiter.client, 0) + 1
+            self._waits[waiter.lane].append(time.monotonic() - waiter.since)
+            waiter.future.set_result(None)
+
+    def _forget_idle(self, lane: str) -> None:
+        # Clientes sin nada en cola cuyo reloj ya quedó atrás del carril: no aportan nada
+        finish = self._finish[lane]
+        vtime = self._vtime[lane]
+        for client in [c for c, f in finish.items() if f <= vtime and c not in self._queues[lane]]:
+            del finish[client]
+
+    def publish(self) -> None:
+        """Vuelca a las métricas el estado de colas y el p50/p99 de espera por carril."""
+        metrics.set_value("sched_running", self._running)
+        for lane in LANES:
+            metrics.set_value(f"sched_{lane}_queued", self.queued(lane))
+            waits = sorted(self._waits[lane])
+            if waits:
+                metrics.set_value(f"sched_{lane}_wait_p50_ms", round(waits[len(waits) // 2] * 1000, 1))
+                metrics.set_value(f"sched_{lane}_wait_p99_ms", round(waits[int(len(waits) * 0.99)] * 1000, 1))
+
+
+# Instancia compartida (un planificador por proceso, igual que el pool)
+scheduler = FairScheduler()
@@ -0,0 +1,41 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.utils import metrics
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave: la primera lanza el
+    trabajo y las siguientes esperan su resultado en lugar de repetirlo.
+    El trabajo corre en su propia tarea, así que si el cliente que lo lanzó
+    se desconecta no se cancela para los demás.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, "asyncio.Task[Any]"] = {}
+
+    def get(self, key: str) -> Optional["asyncio.Task[Any]"]:
+        return self._inflight.get(key)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.incr(f"{self.name}_coalesced")
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def wait(self, key: str) -> None:
+        """Espera a que termine el trabajo en curso para `key`, si lo hay (ignora su error)."""
+        task = self._inflight.get(key)
+        if task is not None:
+            await asyncio.wait([task])
+
+
+# Procesados en curso, por nombre del fichero de salida en `processed/`
+processing_flights = SingleFlight("process")
@@ -0,0 +1,217 @@
+import os
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from app.services import progress
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración (variables de entorno, con valores por defecto razonables)
+PROCESS_WORKERS: int = int(os.getenv("PROCESS_WORKERS", str(os.cpu_count() or 1)))
+PROCESS_QUEUE_SIZE: int = int(os.getenv("PROCESS_QUEUE_SIZE", "8"))
+PROCESS_MAX_TASKS_PER_CHILD: int = int(os.getenv("PROCESS_MAX_TASKS_PER_CHILD", "50"))
+PROCESS_RETRY_AFTER_SECONDS: int = int(os.getenv("PROCESS_RETRY_AFTER_SECONDS", "5"))
+
+
+class PoolSaturated(Exception):
+    """La cola del pool está llena; el cliente debe reintentar más tarde."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Processing queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PoolBusy(PoolSaturated):
+    """No hay ningún hijo libre para una tarea de baja prioridad: se descarta."""
+
+
+# (task_id, etapa, fracción); lo recibe el proceso principal en el event loop
+ProgressHandler = Callable[[str, str, float], None]
+
+
+def _warm_worker(progress_queue: Optional[Any] = None) -> None:
+    """Inicializador de cada proceso hijo: importa cv2/numpy una sola vez."""
+    import cv2  # noqa: F401
+    import numpy  # noqa: F401
+    import app.services.image_processing  # noqa: F401
+    progress.install(progress_queue)
+
+
+def _noop() -> None:
+    """Tarea vacía para arrancar los hijos por adelantado."""
+
+
+class ProcessingPool:
+    """
+    Pool de procesos precalentados para el trabajo CPU-bound (process_image).
+    - Cola acotada: como máximo `workers + max_queue` tareas admitidas a la vez.
+    - Los hijos se reciclan (fragmentación de memoria): tras `workers ×
+      max_tasks_per_child` tareas se abre un ejecutor nuevo y el anterior
+      termina lo que tiene en curso y se cierra.
+    - Si un hijo muere con una tarea en curso (p. ej. lo mata el OOM killer),
+      sus tareas fallan con BrokenProcessPool en vez de quedarse colgadas, el
+      hueco se libera y se abre un ejecutor nuevo para las siguientes.
+    - Las tareas de baja prioridad (trabajo especulativo) solo se lanzan con
+      algún hijo libre: si al enviarlas no lo hay, run() lanza PoolBusy. No
+      cuentan para llenar la cola de las peticiones explícitas, así que nunca
+      les provocan un 503.
+    """
+
+    def __init__(
+        self,
+        workers: int = PROCESS_WORKERS,
+        max_queue: int = PROCESS_QUEUE_SIZE,
+        max_tasks_per_child: int = PROCESS_MAX_TASKS_PER_CHILD,
+        retry_after: int = PROCESS_RETRY_AFTER_SECONDS,
+    ):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self.retry_after = retry_after
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._submitted = 0
+        # Tareas en curso por ejecutor (los retirados siguen aquí hasta vaciarse)
+        self._running: Dict[ProcessPoolExecutor, int] = {}
+        self._pending = 0
+        self._low_priority = 0
+        self._progress_queue: Optional[Any] = None
+        self._progress_thread: Optional[threading.Thread] = None
+        self.progress_handler: Optional[ProgressHandler] = None
+
+    @property
+    def started(self) -> bool:
+        return self._pool is not None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def idle(self) -> bool:
+        """Hay algún hijo sin trabajo."""
+        return self._pending < self.workers
+
+    def _open(self) -> ProcessPoolExecutor:
+        # "spawn" evita heredar el estado del event loop / hilos del proceso padre
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_worker,
+            initargs=(self._progress_queue,),
+        )
+        # Los hijos se crean al primer uso: se arrancan ya para que estén calientes
+        for _ in range(self.workers):
+            pool.submit(_noop)
+        self._running[pool] = 0
+        self._submitted = 0
+        return pool
+
+    def _retire(self, pool: ProcessPoolExecutor) -> None:
+        """Deja de usar `pool`: no admite más tareas y sus hijos salen al terminar."""
+        if pool is self._pool:
+            self._pool = self._open()
+        pool.shutdown(wait=False)
+        if not self._running.get(pool):
+            self._running.pop(pool, None)
+
+    def start(self) -> None:
+        if self._pool is not None:
+            return
+        self._progress_queue = multiprocessing.get_context("spawn").Queue()
+        self._pool = self._open()
+        try:
+            loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        self._progress_thread = threading.Thread(
+            target=self._relay_progress, args=(self._progress_queue, loop), name="pool-progress", daemon=True,
+        )
+        self._progress_thread.start()
+        logger.info("Processing pool started (%d workers)", self.workers)
+
+    def _relay_progress(self, queue: Any, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        """Hilo que pasa al event loop los avisos de progreso de los hijos."""
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            handler = self.progress_handler
+            if handler is not None and loop is not None:
+                loop.call_soon_threadsafe(handler, *item)
+
+    async def stop(self) -> None:
+        if self._pool is None:
+            return
+        self._pool = None
+        pools, self._running = list(self._running), {}
+        # shutdown(wait=True) bloquea: se ejecuta fuera del event loop
+        loop = asyncio.get_running_loop()
+        for pool in pools:
+            await loop.run_in_executor(None, pool.shutdown)
+        self._progress_queue.put(None)
+        await loop.run_in_executor(None, self._progress_thread.join)
+        self._progress_queue.close()
+        self._progress_queue = self._progress_thread = None
+        logger.info("Processing pool stopped")
+
+    async def run(self, fn: Callable[..., Any], *args: Any, low_priority: bool = False) -> Any:
+        """Ejecuta `fn(*args)` en un proceso hijo sin bloquear el event loop."""
+        if self._pool is None:
+            raise RuntimeError("Processing pool is not started")
+        if low_priority and self._pending >= self.workers:
+            # Se mira al enviar: `idle` pudo cambiar en las esperas de quien llama
+            raise PoolBusy(self.retry_after)
+        if self._pending - self._low_priority >= self.workers + self.max_queue:
+            raise PoolSaturated(self.retry_after)
+
+        if self.max_tasks_per_child and self._submitted >= self.workers * self.max_tasks_per_child:
+            self._retire(self._pool)
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        pool = self._pool
+        try:
+            task = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            # Roto por un hijo muerto antes de que se viera en _settle: uno nuevo
+            self._retire(pool)
+            pool = self._pool
+            task = pool.submit(fn, *args)
+        self._submitted += 1
+        self._running[pool] += 1
+        self._pending += 1
+        self._low_priority += low_priority
+
+        def _settle(done: Future) -> None:
+            # El hueco se libera cuando el hijo termina (o muere), no cuando el cliente se va
+            self._pending -= 1
+            self._low_priority -= low_priority
+            if pool in self._running:
+                self._running[pool] -= 1
+            error = done.exception()
+            if isinstance(error, BrokenProcessPool):
+                metrics.incr("pool_broken_tasks")
+                if pool is self._pool:
+                    logger.warning("A pool worker died; restarting the processing pool")
+                    self._retire(pool)
+            if pool is not self._pool and not self._running.get(pool):
+                self._running.pop(pool, None)
+            if fut.done():
+                return
+            if error is None:
+                fut.set_result(done.result())
+            else:
+                fut.set_exception(error)
+
+        task.add_done_callback(lambda done: loop.call_soon_threadsafe(_settle, done))
+        return await fut
+
+
+# Instancia compartida; la arranca/detiene el lifespan de la app (main.py)
+processing_pool = ProcessingPool()
@@ -0,0 +1,223 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import mimetypes
+from typing import Any, Iterator, Optional, Tuple
+
+from app.utils import metrics
+from app.utils.catalog import catalog
+from app.utils.storage_backend import STORAGE_BACKEND, StorageBackend, LocalBackend, create_backend, link_or_copy
+
+# Almacén de contenidos (variables de entorno)
+BLOB_FOLDER: str = os.getenv("BLOB_FOLDER", "blobs")
+# Con un backend remoto: copias locales (para procesar y servir) sin usar en este tiempo se borran
+BLOB_LOCAL_CACHE_SECONDS: int = int(os.getenv("BLOB_LOCAL_CACHE_SECONDS", "3600"))
+# Un blob sin referencias se borra pasado este margen (cubre descargas ya resueltas)
+BLOB_GRACE_SECONDS: int = 60
+# Temporales abandonados (caída a mitad de una subida o de un procesado)
+_STAGING_MAX_AGE_SECONDS = 3600
+_CHUNK_SIZE = 1024 * 1024
+_COLLECT_WAIT_SECONDS = 0.05
+
+logger = logging.getLogger("cleanup_logger")
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 completo de un fichero, leído por bloques."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BlobStore:
+    """
+    Ficheros direccionados por contenido: cada contenido se guarda una sola
+    vez con la clave `ab/cd/<sha256 completo>` (dos niveles de 256 carpetas,
+    así ningún directorio crece sin límite) en el backend de almacenamiento
+    (app/utils/storage_backend.py: disco local o un bucket S3). Los nombres
+    que ven los clientes son alias en el catálogo (app/utils/catalog.py), sin
+    fichero propio; el blob se borra cuando ningún alias lo referencia
+    (collect(), desde el janitor).
+    Los temporales de subidas y procesados se escriben en `<root>/.staging`,
+    en el mismo sistema de ficheros, para que guardarlos sea solo un rename.
+    Con un backend remoto, `<root>/ab/cd/<sha256>` guarda además copias
+    locales de lo que se procesa (el pool trabaja sobre ficheros).
+    """
+
+    def __init__(self, root: str = BLOB_FOLDER, grace: float = BLOB_GRACE_SECONDS,
+                 backend: Optional[StorageBackend] = None, local_cache_seconds: float = BLOB_LOCAL_CACHE_SECONDS):
+        self.root = root
+        self.grace = grace
+        self.local_cache_seconds = local_cache_seconds
+        self.staging = os.path.join(root, ".staging")
+        if backend is None:
+            # Un backend remoto puede compartirse entre réplicas (cada una con su catálogo):
+            # reconcile() y collect() solo deben ver los blobs de este catálogo
+            namespace = catalog.instance_id() if STORAGE_BACKEND != "local" else ""
+            backend = create_backend(root, namespace=namespace)
+        self.backend = backend
+
+    @staticmethod
+    def key(digest: str) -> str:
+        return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+    def path(self, digest: str) -> str:
+        """Ruta en disco del blob (backend local) o de su copia local (backend remoto)."""
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def staging_path(self, suffix: str = "") -> str:
+        os.makedirs(self.staging, exist_ok=True)
+        return os.path.join(self.staging, f"{uuid.uuid4().hex}{suffix}")
+
+    def _place(self, src: str, digest: str, move: bool) -> str:
+        dst = self.path(digest)
+        if self.backend.exists(self.key(digest)):
+            # Mismo contenido ya guardado: no se escribe dos veces
+            metrics.incr("blob_dedup_hits")
+            if self.backend.local:
+                if move:
+                    os.remove(src)
+                return dst
+        else:
+            self.backend.put_file(self.key(digest), src, move=move and self.backend.local)
+            if self.backend.local:
+                return dst
+        # Backend remoto: el fichero se queda como copia local (se va a procesar enseguida)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if move:
+            os.replace(src, dst)
+        else:
+            link_or_copy(src, dst)
+        return dst
+
+    def ingest(self, src: str, alias: str, digest: Optional[str] = None, move: bool = True, **meta: Any) -> str:
+        """
+        Guarda `src` como blob y apunta `alias` a él; devuelve la ruta local
+        del blob (ver path()). La referencia se toma antes de escribir, así
+        collect() no puede borrarlo entre medias.
+        """
+        if digest is None:
+            digest = file_digest(src)
+        size = os.path.getsize(src)
+        while not catalog.link(alias, digest, size, **meta):
+            # collect() está borrando este mismo contenido: se vuelve a guardar cuando acabe
+            time.sleep(_COLLECT_WAIT_SECONDS)
+        return self._place(src, digest, move)
+
+    def alias(self, alias: str, digest: str, **meta: Any) -> Optional[str]:
+        """Apunta `alias` a un blob ya guardado y devuelve su SHA-256; None si ese blob no existe."""
+        if not catalog.link(alias, digest, **meta):
+            return None
+        if not self.backend.exists(self.key(digest)):
+            # Borrado por fuera del almacén: la reconciliación lo habría visto
+            catalog.unlink(alias)
+            return None
+        return digest
+
+    def lookup(self, alias: str) -> Optional[str]:
+        """
+        SHA-256 del blob de `alias`, o None. Los ficheros sueltos de versiones
+        anteriores no se miran aquí: los adopta el janitor al reconciliar.
+        """
+        row = catalog.get(alias)
+        return row["sha256"] if row is not None else None
+
+    def cached_path(self, digest: str) -> Optional[str]:
+        """Ruta en disco del blob si la hay ya (backend local o copia local), sin descargar nada."""
+        path = self.backend.local_path(self.key(digest))
+        if path is not None:
+            return path
+        path = self.path(digest)
+        try:
+            os.utime(path)  # uso reciente: la copia no se poda ahora
+        except FileNotFoundError:
+            return None
+        return path
+
+    def local_path(self, digest: str) -> str:
+        """Ruta en disco del blob; con un backend remoto lo descarga la primera vez (bloqueante)."""
+        path = self.cached_path(digest)
+        if path is None:
+            path = self.path(digest)
+            self.backend.get_file(self.key(digest), path)
+            metrics.incr("blob_local_fetches")
+        return path
+
+    def read(self, digest: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Bytes [start, end) del blob, por bloques (para servirlo sin tenerlo en disco)."""
+        return self.backend.read(self.key(digest), start, end)
+
+    def adopt(self, path: str, mtime: float) -> str:
+        """
+        Da de alta un fichero suelto como alias de su mismo nombre. Se enlaza
+        (no se mueve): el original sigue ahí hasta que caduque y el alias
+        caduca a la vez, porque conserva su mtime.
+        """
+        metrics.incr("blob_adopted")
+        return self.ingest(path, path, move=False, mtime=mtime, mime=mimetypes.guess_type(path)[0])
+
+    def remove(self, digest: str) -> None:
+        self.backend.delete(self.key(digest))
+        if not self.backend.local:
+            try:
+                os.remove(self.path(digest))
+            except FileNotFoundError:
+                pass
+
+    def collect(self) -> int:
+        """Borra los blobs sin alias; devuelve cuántos."""
+        collected = catalog.collect(self.remove, self.grace)
+        if collected:
+            metrics.incr("blobs_collected", collected)
+        return collected
+
+    def _walk(self, backend: StorageBackend) -> Iterator[Tuple[str, float]]:
+        """(sha256, mtime) de los blobs de `backend` (otras claves se ignoran)."""
+        for key, mtime in backend.list():
+            digest = key.rsplit("/", 1)[-1]
+            if key == self.key(digest):
+                yield digest, mtime
+
+    def reconcile(self) -> Tuple[int, int]:
+        """
+        Compara catálogo y backend: olvida los blobs que faltan y borra los
+        que no tienen fila (y temporales abandonados o copias locales sin
+        usar). Devuelve (olvidados, borrados).
+        """
+        now = time.time()
+        # Lo enlazado hace poco puede estar subiéndose aún (ingest enlaza antes de escribir)
+        known = catalog.blob_ids(linked_before=now - self.grace)
+        stored = dict(self._walk(self.backend))
+        removed = 0
+        # Releído tras listar: lo enlazado mientras tanto no es huérfano
+        referenced = catalog.blob_ids()
+        for digest, mtime in stored.items():
+            if digest not in referenced and mtime < now - self.grace:
+                self.remove(digest)
+                removed += 1
+        if os.path.isdir(self.staging):
+            for entry in os.scandir(self.staging):
+                if entry.is_file() and entry.stat().st_mtime < now - _STAGING_MAX_AGE_SECONDS:
+                    os.remove(entry.path)
+                    removed += 1
+        if not self.backend.local:
+            for digest, mtime in self._walk(LocalBackend(self.root)):
+                if mtime < now - self.local_cache_seconds:
+                    try:
+                        os.remove(self.path(digest))
+                    except FileNotFoundError:
+                        pass
+        # exists() antes de la transacción: con S3 es una petición por blob
+        missing = [d for d in known - stored.keys() if not self.backend.exists(self.key(d))]
+        forgotten = catalog.drop_blobs(missing, linked_before=now - self.grace)
+        if forgotten or removed:
+            logger.info(f"📦 Blob store reconciled: {forgotten} missing, {removed} orphan files removed")
+        return forgotten, removed
+
+
+# Instancia compartida
+blob_store = BlobStore()
@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Catálogo persistente de artefactos (variables de entorno)
+CATALOG_PATH: str = os.getenv("CATALOG_PATH", "catalog.db")
+CATALOG_BUSY_TIMEOUT_MS: int = int(os.getenv("CATALOG_BUSY_TIMEOUT_MS", "5000"))
+
+# Tipo de artefacto según la carpeta (lógica) de su nombre
+KIND_BY_FOLDER: Dict[str, str] = {
+    "uploads": "upload",
+    "processed": "processed",
+    os.path.join("processed", ".cache"): "cache",
+}
+
+_SCHEMA_VERSION = 4
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+DROP TABLE IF EXISTS artifacts;
+DROP TABLE IF EXISTS blobs;
+CREATE TABLE blobs (
+    sha256     TEXT PRIMARY KEY,
+    size       INTEGER NOT NULL,
+    refs       INTEGER NOT NULL,
+    released   REAL,
+    linked     REAL,
+    collecting REAL
+);
+CREATE INDEX IF NOT EXISTS blobs_unreferenced ON blobs (released) WHERE refs <= 0;
+CREATE TABLE artifacts (
+    path        TEXT PRIMARY KEY,
+    folder      TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    sha256      TEXT NOT NULL,
+    source      TEXT,
+    mime        TEXT,
+    width       INTEGER,
+    height      INTEGER,
+    size        INTEGER NOT NULL,
+    params      TEXT,
+    pipeline    TEXT,
+    process_ms  REAL,
+    mtime       REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX artifacts_sha256 ON artifacts (sha256, kind);
+CREATE INDEX artifacts_mtime ON artifacts (mtime);
+CREATE INDEX artifacts_access ON artifacts (folder, last_access);
+"""
+# Migraciones en el sitio (se conservan las referencias): versión de origen -> script
+_MIGRATIONS: Dict[int, str] = {
+    2: """
+ALTER TABLE blobs ADD COLUMN linked REAL;
+ALTER TABLE blobs ADD COLUMN collecting REAL
+""",
+    3: """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+)
+""",
+}
+
+# Un borrado de blobs (collect) que no termina en este tiempo se da por abandonado
+_COLLECT_LEASE_SECONDS = 120
+
+# Columnas de metadatos: si una escritura no las trae se conserva lo ya guardado
+_META = ("source", "mime", "width", "height", "params", "pipeline", "process_ms")
+
+
+def in_progress(name: str) -> bool:
+    """Temporales de escritura (.upload-*.part, *.tmp<pid>.*): los gestiona quien los escribe."""
+    return name.startswith(".") or ".tmp" in name
+
+
+def _key(path: str) -> str:
+    # Mismo nombre para "uploads/x.jpg", "./uploads/x.jpg" o la ruta absoluta
+    return os.path.relpath(path)
+
+
+def _marks(values: List[str]) -> str:
+    return ", ".join("?" * len(values))
+
+
+class Catalog:
+    """
+    Índice en SQLite de lo guardado, en dos tablas:
+    - `blobs`: contenidos (por SHA-256 completo) con su contador de
+      referencias; los ficheros viven en el almacén de app/utils/blob_store.py.
+    - `artifacts`: los nombres que ven los clientes (`uploads/<nombre>`,
+      `processed/<nombre>`, `processed/.cache/<clave>.jpg`), cada uno un alias
+      de un blob, con dimensiones, tipo, parámetros y tiempo de procesado,
+      mtime (caducidad) y último acceso (expulsión LRU).
+    Crear o borrar un alias ajusta `refs` en la misma transacción; un blob sin
+    referencias solo se borra en collect(), que lo marca antes (`collecting`):
+    mientras tanto link() no lo enlaza, así que nunca se borra un contenido
+    que otro worker acaba de enlazar.
+    - Cada consulta es una búsqueda por índice (O(log n)).
+    - Modo WAL: los workers de uvicorn comparten el fichero, leen sin
+      bloquearse y las escrituras esperan turno hasta `busy_timeout`.
+    - Una conexión por hilo (sqlite3 no comparte conexiones entre hilos).
+    """
+
+    def __init__(self, path: str = CATALOG_PATH, busy_timeout_ms: int = CATALOG_BUSY_TIMEOUT_MS):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                # Esquema anterior: se migra paso a paso si se sabe; si no, se
+                # rehace y la reconciliación del janitor lo repuebla
+                with self._transaction(conn):
+                    version = conn.execute("PRAGMA user_version").fetchone()[0]
+                    scripts = []
+                    while version in _MIGRATIONS:
+                        scripts.append(_MIGRATIONS[version])
+                        version += 1
+                    if version != _SCHEMA_VERSION:
+                        scripts = [_SCHEMA]
+                    for script in scripts:
+                        for statement in script.split(";"):
+                            if statement.strip():
+                                conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self, conn: Optional[sqlite3.Connection] = None) -> Iterator[sqlite3.Connection]:
+        conn = conn or self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _release(conn: sqlite3.Connection, sha256: str, now: float) -> None:
+        conn.execute(
+            "UPDATE blobs SET refs = refs - 1, released = CASE WHEN refs <= 1 THEN ? END WHERE sha256 = ?",
+            (now, sha256),
+        )
+
+    def instance_id(self) -> str:
+        """
+        Identificador de este catálogo, creado la primera vez. Con un backend
+        compartido (un bucket para varias réplicas) separa sus blobs de los
+        de otros catálogos.
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'instance_id'").fetchone()
+            if row is not None:
+                return row[0]
+            value = uuid.uuid4().hex
+            conn.execute("INSERT INTO meta (key, value) VALUES ('instance_id', ?)", (value,))
+        return value
+
+    def link(self, path: str, sha256: str, size: Optional[int] = None, mtime: Optional[float] = None,
+             **meta: Any) -> bool:
+        """
+        Hace de `path` un alias del blob `sha256` (creándolo con `size` si no
+        existe) y lo da por recién escrito. `meta` son columnas de _META.
+        False si el blob no existe y no se dio `size`, o si collect() lo está
+        borrando (quien lo guarda de nuevo reintenta cuando termine).
+        """
+        path = _key(path)
+        now = time.time()
+        folder = os.path.dirname(path)
+        if isinstance(meta.get("params"), dict):
+            meta["params"] = json.dumps(meta["params"], sort_keys=True)
+        with self._transaction() as conn:
+            blob = conn.execute("SELECT size, collecting FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if blob is not None and blob[1] is not None:
+                if blob[1] > now - _COLLECT_LEASE_SECONDS:
+                    return False
+                # Borrado abandonado (el janitor cayó a mitad): el blob vuelve a usarse
+                conn.execute("UPDATE blobs SET collecting = NULL WHERE sha256 = ?", (sha256,))
+            if size is None:
+                if blob is None:
+                    return False
+                size = blob[0]
+            old = conn.execute("SELECT sha256 FROM artifacts WHERE path = ?", (path,)).fetchone()
+            if old is None or old[0] != sha256:
+                if old is not None:
+                    self._release(conn, old[0], now)
+                conn.execute(
+                    "INSERT INTO blobs (sha256, size, refs, linked) VALUES (?, ?, 1, ?) "
+                    "ON CONFLICT(sha256) DO UPDATE SET refs = refs + 1, released = NULL, linked = excluded.linked",
+                    (sha256, size, now),
+                )
+            row = {name: meta.get(name) for name in _META}
+            row.update(path=path, folder=folder, kind=KIND_BY_FOLDER.get(folder, "other"), sha256=sha256,
+                       size=size, mtime=mtime or now, last_access=now)
+            updates = ", ".join(
+                f"{c} = COALESCE(excluded.{c}, {c})" if c in _META else f"{c} = excluded.{c}"
+                for c in row if c != "path"
+            )
+            conn.execute(
+                f"INSERT INTO artifacts ({', '.join(row)}) VALUES ({', '.join(':' + c for c in row)}) "
+                f"ON CONFLICT(path) DO UPDATE SET {updates}",
+                row,
+            )
+        return True
+
+    def unlink(self, *paths: str) -> int:
+        """Borra alias; sus blobs pierden una referencia. Devuelve los alias borrados."""
+        now = time.time()
+        removed = 0
+        with self._transaction() as conn:
+            for path in paths:
+                row = conn.execute("SELECT sha256 FROM artifacts WHERE path = ?", (_key(path),)).fetchone()
+                if row is not None:
+                    conn.execute("DELETE FROM artifacts WHERE path = ?", (_key(path),))
+                    self._release(conn, row[0], now)
+                    removed += 1
+        return removed
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM artifacts WHERE path = ?", (_key(path),)).fetchone()
+        return dict(row) if row is not None else None
+
+    def find_sha256(self, sha256: str, kind: str = "upload") -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT * FROM artifacts WHERE sha256 = ? AND kind = ?", (sha256, kind),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def refresh(self, path: str) -> None:
+        """El alias vuelve a contar desde ahora para la caducidad (lo que antes hacía os.utime)."""
+        now = time.time()
+        self._conn().execute("UPDATE artifacts SET mtime = ?, last_access = ? WHERE path = ?", (now, now, _key(path)))
+
+    def touch(self, accessed: Dict[str, float]) -> None:
+        """Último acceso ({alias: instante}) para la expulsión LRU; una sola transacción."""
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE artifacts SET last_access = MAX(last_access, ?) WHERE path = ?",
+                [(when, _key(path)) for path, when in accessed.items()],
+            )
+
+    def expired(self, before: float, limit: int = 5000) -> List[str]:
+        """Alias escritos por última vez antes de `before`, más antiguos primero."""
+        rows = self._conn().execute(
+            "SELECT path FROM artifacts WHERE mtime <= ? ORDER BY mtime LIMIT ?", (before, limit),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def usage(self, folders: Iterable[str]) -> int:
+        """Bytes de los blobs a los que apunta algún alias de `folders` (cada blob una vez)."""
+        folders = list(folders)
+        row = self._conn().execute(
+            f"SELECT COALESCE(SUM(size), 0) FROM blobs WHERE sha256 IN "
+            f"(SELECT sha256 FROM artifacts WHERE folder IN ({_marks(folders)}))",
+            folders,
+        ).fetchone()
+        return int(row[0])
+
+    def lru(self, folders: Iterable[str]) -> List[Tuple[List[str], int, float]]:
+        """(alias, tamaño, último acceso) por blob de `folders`, de menos a más usado."""
+        folders = list(folders)
+        conn = self._conn()
+        groups = conn.execute(
+            f"SELECT sha256, MAX(size), MAX(last_access) AS accessed FROM artifacts "
+            f"WHERE folder IN ({_marks(folders)}) GROUP BY sha256 ORDER BY accessed",
+            folders,
+        ).fetchall()
+        result = []
+        for sha256, size, accessed in groups:
+            paths = [r[0] for r in conn.execute(
+                f"SELECT path FROM artifacts WHERE sha256 = ? AND folder IN ({_marks(folders)})",
+                [sha256] + folders,
+            )]
+            result.append((paths, size, accessed))
+        return result
+
+    def collect(self, remove: Callable[[str], None], grace: float, limit: int = 1000) -> int:
+        """
+        Borra los blobs sin referencias desde hace más de `grace` segundos.
+        Se marcan en una transacción corta, `remove(sha256)` borra cada
+        fichero fuera de ella (con S3 es una petición por blob) y otra
+        transacción corta olvida las filas. Devuelve los blobs borrados.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT sha256 FROM blobs WHERE refs <= 0 AND released <= ? "
+                "AND (collecting IS NULL OR collecting <= ?) LIMIT ?",
+                (now - grace, now - _COLLECT_LEASE_SECONDS, limit),
+            ).fetchall()
+            conn.executemany("UPDATE blobs SET collecting = ? WHERE sha256 = ?", [(now, r[0]) for r in rows])
+        removed: List[Tuple[str]] = []
+        try:
+            for (sha256,) in rows:
+                remove(sha256)
+                removed.append((sha256,))
+        finally:
+            with self._transaction() as conn:
+                conn.executemany("DELETE FROM blobs WHERE sha256 = ? AND collecting = ?",
+                                 [(sha256, now) for (sha256,) in removed])
+                # Lo que no llegó a borrarse (error del backend) queda libre para reintentarlo
+                conn.executemany("UPDATE blobs SET collecting = NULL WHERE sha256 = ? AND collecting = ?",
+                                 [(r[0], now) for r in rows[len(removed):]])
+        return len(removed)
+
+    def blob_ids(self, linked_before: Optional[float] = None) -> Set[str]:
+        """SHA-256 de los blobs; con `linked_before`, solo los enlazados por última vez antes."""
+        if linked_before is None:
+            return {r[0] for r in self._conn().execute("SELECT sha256 FROM blobs")}
+        rows = self._conn().execute(
+            "SELECT sha256 FROM blobs WHERE linked IS NULL OR linked <= ?", (linked_before,),
+        )
+        return {r[0] for r in rows}
+
+    def drop_blobs(self, sha256s: Iterable[str], linked_before: float) -> int:
+        """
+        Olvida blobs cuyo fichero ya no existe, con todos sus alias. Se salta
+        los enlazados después de `linked_before`: su fichero puede estar
+        subiéndose todavía.
+        """
+        dropped = 0
+        with self._transaction() as conn:
+            for sha256 in sha256s:
+                row = conn.execute("SELECT linked FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+                if row is None or (row[0] is not None and row[0] > linked_before):
+                    continue
+                conn.execute("DELETE FROM artifacts WHERE sha256 = ?", (sha256,))
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                dropped += 1
+        return dropped
+
+
+# Instancia compartida (conexiones por hilo; el fichero lo comparten los workers)
+catalog = Catalog()
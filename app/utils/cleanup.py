@@ -1,15 +1,33 @@
 import os
 import time
+import asyncio
 import logging
 from logging.handlers import RotatingFileHandler
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos (un solo worker)
+    fcntl = None
+
+from app.utils import metrics
+from app.utils.blob_store import blob_store
+from app.utils.catalog import catalog, in_progress
+from app.utils.storage_budget import storage_budget
 
 MAX_FILE_AGE_SECONDS = 28800 # 8 horas
-FOLDERS_TO_CLEAN = ["uploads", "processed"]
+# Carpetas planas de antes del almacén de blobs: lo que quede se adopta o caduca
+FOLDERS_TO_CLEAN = ["uploads", "processed", os.path.join("processed", ".cache")]
+
+# Janitor (variables de entorno)
+JANITOR_INTERVAL_SECONDS: int = int(os.getenv("JANITOR_INTERVAL_SECONDS", "60"))
+JANITOR_RECONCILE_SECONDS: int = int(os.getenv("JANITOR_RECONCILE_SECONDS", "900"))
 
 # Configuración del logger con rotación
 log_dir = "logs"
 log_path = os.path.join(log_dir, "cleanup.log")
 os.makedirs(log_dir, exist_ok=True)
+JANITOR_LOCK_FILE: str = os.getenv("JANITOR_LOCK_FILE", os.path.join(log_dir, ".janitor.lock"))
 
 logger = logging.getLogger("cleanup_logger")
 logger.setLevel(logging.INFO)
@@ -26,18 +44,155 @@ handler.setFormatter(formatter)
 if not logger.hasHandlers():
     logger.addHandler(handler)
 
-def delete_old_files():
-    now = time.time()
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        logger.info(f"🗑️ Deleted old file: {path}")
+        return True
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logger.error(f"❌ Error deleting {path}: {e}")
+        return False
+
+
+def _scan(now: float) -> Tuple[List[Tuple[str, os.stat_result]], int]:
+    """Recorre las carpetas una vez: borra lo caducado y devuelve (ruta, stat) del resto."""
+    alive: List[Tuple[str, os.stat_result]] = []
+    deleted = 0
     for folder in FOLDERS_TO_CLEAN:
         if not os.path.exists(folder):
             continue
-        for filename in os.listdir(folder):
-            path = os.path.join(folder, filename)
-            if os.path.isfile(path):
-                file_age = now - os.path.getmtime(path)
-                if file_age > MAX_FILE_AGE_SECONDS:
-                    try:
-                        os.remove(path)
-                        logger.info(f"🗑️ Deleted old file: {path}")
-                    except Exception as e:
-                        logger.error(f"❌ Error deleting {path}: {e}")
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat()
+                if st.st_mtime + MAX_FILE_AGE_SECONDS <= now:
+                    deleted += _remove(entry.path)
+                else:
+                    alive.append((entry.path, st))
+    return alive, deleted
+
+
+def delete_old_files():
+    """Barrido completo e inmediato (el janitor lo hace solo al arrancar y cada JANITOR_RECONCILE_SECONDS)."""
+    now = time.time()
+    _scan(now)
+    catalog.unlink(*catalog.expired(now - MAX_FILE_AGE_SECONDS))
+    blob_store.collect()
+
+
+class Janitor:
+    """
+    Limpieza periódica única por proceso, arrancada por el lifespan de la app.
+    - Los nombres guardados son alias en el catálogo (app/utils/catalog.py)
+      con su mtime; cada barrido le pide lo caducado (consulta por índice),
+      sin listar directorios, y borra esos alias. El catálogo es compartido,
+      así que ve también lo que escriben los demás workers.
+    - Tras la limpieza por edad aplica el presupuesto de bytes de cada carpeta
+      (app/utils/storage_budget.py) y al final borra los blobs que se han
+      quedado sin alias (app/utils/blob_store.py).
+    - Con varios workers de uvicorn solo barre el que tiene el bloqueo de
+      JANITOR_LOCK_FILE. Ese proceso reconcilia catálogo y disco al obtenerlo
+      y cada `reconcile_interval`: adopta los ficheros sueltos de las carpetas
+      antiguas y repara blobs perdidos o huérfanos.
+    """
+
+    def __init__(self, interval: int = JANITOR_INTERVAL_SECONDS, reconcile_interval: int = JANITOR_RECONCILE_SECONDS,
+                 lock_path: str = JANITOR_LOCK_FILE):
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self.lock_path = lock_path
+        self._lock_fd: Optional[int] = None
+        self._last_reconcile = 0.0
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    @property
+    def leader(self) -> bool:
+        return self._lock_fd is not None
+
+    def _try_lock(self) -> bool:
+        if self._lock_fd is not None:
+            return True
+        if fcntl is None:
+            self._lock_fd = -1
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        logger.info(f"🧹 Janitor leader (pid {os.getpid()})")
+        return True
+
+    def _unlock(self) -> None:
+        fd, self._lock_fd = self._lock_fd, None
+        if fd is not None and fd >= 0:
+            os.close(fd)  # libera el flock
+
+    def reconcile(self) -> int:
+        """Recorre el disco, borra lo caducado y pone el catálogo al día; devuelve los ficheros borrados."""
+        now = time.time()
+        alive, deleted = _scan(now)
+        adopted = 0
+        for path, st in alive:
+            if not in_progress(os.path.basename(path)) and catalog.get(path) is None:
+                blob_store.adopt(path, st.st_mtime)
+                adopted += 1
+        if adopted:
+            logger.info(f"📇 Adopted {adopted} loose files into the blob store")
+        blob_store.reconcile()
+        self._last_reconcile = now
+        metrics.incr("janitor_reconciles")
+        return deleted
+
+    def run_once(self) -> int:
+        """Un barrido: borra lo que vence ahora. Devuelve los ficheros borrados."""
+        # Todos los workers guardan sus accesos; solo el que tiene el bloqueo barre
+        storage_budget.flush()
+        if not self._try_lock():
+            return 0  # otro worker barre (el catálogo es común)
+        now = time.time()
+        deleted = 0
+        if now - self._last_reconcile >= self.reconcile_interval:
+            deleted += self.reconcile()
+        expired = catalog.expired(now - MAX_FILE_AGE_SECONDS)
+        if expired:
+            deleted += catalog.unlink(*expired)
+            logger.info(f"🗑️ Expired {len(expired)} names: {', '.join(expired[:10])}")
+        # Después de la edad, el tamaño: expulsión LRU por presupuesto de cada carpeta
+        storage_budget.enforce()
+        # Contenidos que ya no nombra nadie
+        blob_store.collect()
+        if deleted:
+            metrics.incr("janitor_deleted", deleted)
+        return deleted
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.run_once)
+            except Exception as e:
+                logger.error(f"❌ Janitor sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await asyncio.get_running_loop().run_in_executor(None, storage_budget.flush)
+        self._unlock()
+
+
+# Instancia compartida; la arranca/detiene el lifespan de la app (main.py)
+janitor = Janitor()
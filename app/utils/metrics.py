@@ -0,0 +1,23 @@
+import threading
+from typing import Dict, Union
+
+# Métricas en memoria del proceso (se exponen en GET /metrics)
+Number = Union[int, float]
+
+_lock = threading.Lock()
+_values: Dict[str, Number] = {}
+
+
+def incr(name: str, value: Number = 1) -> None:
+    with _lock:
+        _values[name] = _values.get(name, 0) + value
+
+
+def set_value(name: str, value: Number) -> None:
+    with _lock:
+        _values[name] = value
+
+
+def snapshot() -> Dict[str, Number]:
+    with _lock:
+        return dict(sorted(_values.items()))
@@ -0,0 +1,309 @@
+import os
+import uuid
+import shutil
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # opcional: solo hace falta con STORAGE_BACKEND=s3
+    boto3 = None
+    ClientError = Exception
+
+# Backend de almacenamiento (variables de entorno)
+STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "local")  # local | s3
+S3_BUCKET: str = os.getenv("S3_BUCKET", "")
+S3_PREFIX: str = os.getenv("S3_PREFIX", "blobs/")
+S3_ENDPOINT_URL: Optional[str] = os.getenv("S3_ENDPOINT_URL") or None  # p. ej. MinIO en local
+S3_REGION: Optional[str] = os.getenv("S3_REGION") or None
+# Tamaño de cada parte de una escritura multipart (S3 exige >= 5 MiB salvo la última)
+S3_PART_SIZE: int = int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024)))
+
+_CHUNK_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Enlace duro (sin copiar bytes); si el sistema de ficheros no lo permite, copia."""
+    tmp = f"{dst}.tmp{os.getpid()}"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class StorageBackend(ABC):
+    """
+    Dónde viven los bytes de los blobs (app/utils/blob_store.py). Las claves
+    son rutas relativas (`ab/cd/<sha256>`). Todo es por bloques: nada carga
+    un objeto entero en memoria.
+    - write(): escritura en streaming; el objeto aparece completo o no aparece.
+    - read(): lectura en streaming de un tramo [start, end).
+    - local_path(): ruta en disco si el backend es local (sendfile, Range de
+      FileResponse, hijos del pool); None si hay que pasar por read().
+    """
+
+    local = False
+
+    @abstractmethod
+    def write(self, key: str) -> "Any":
+        """Context manager que devuelve un objeto con write(bytes)."""
+        raise NotImplementedError
+
+    def put_file(self, key: str, src: str, move: bool = False) -> None:
+        with open(src, "rb") as f, self.write(key) as out:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                out.write(chunk)
+        if move:
+            os.remove(src)
+
+    @abstractmethod
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        raise NotImplementedError
+
+    def get_file(self, key: str, dst: str) -> None:
+        """Copia el objeto a `dst` (atómico: temporal + rename)."""
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        tmp = f"{dst}.tmp{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in self.read(key):
+                    f.write(chunk)
+            os.replace(tmp, dst)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list(self) -> Iterator[Tuple[str, float]]:
+        """(clave, mtime) de todos los objetos."""
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[str]:
+        return None
+
+
+class _LocalWriter:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.tmp = f"{path}.tmp{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        self._file = open(self.tmp, "wb")
+
+    def write(self, data: bytes) -> None:
+        self._file.write(data)
+
+    def commit(self) -> None:
+        self._file.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+class LocalBackend(StorageBackend):
+    """Ficheros bajo `root`. Mover o enlazar un fichero ya escrito es un rename o un enlace duro."""
+
+    local = True
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    @contextmanager
+    def write(self, key: str) -> Iterator[_LocalWriter]:
+        writer = _LocalWriter(self._path(key))
+        try:
+            yield writer
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def put_file(self, key: str, src: str, move: bool = False) -> None:
+        dst = self._path(key)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if move:
+            os.replace(src, dst)
+        else:
+            link_or_copy(src, dst)
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                chunk = f.read(_CHUNK_SIZE if remaining is None else min(_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def get_file(self, key: str, dst: str) -> None:
+        link_or_copy(self._path(key), dst)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self) -> Iterator[Tuple[str, float]]:
+        if not os.path.isdir(self.root):
+            return
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            # Carpetas internas (.staging, ...) y temporales de escritura no son objetos
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for name in filenames:
+                if name.startswith(".") or ".tmp" in name:
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    mtime = os.stat(path).st_mtime
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(path, self.root).replace(os.sep, "/"), mtime
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self._path(key)
+
+
+class _MultipartWriter:
+    """
+    Escritura en streaming a S3: acumula hasta `part_size` y sube cada parte
+    (multipart upload). Un objeto pequeño se sube de una vez con put_object.
+    """
+
+    def __init__(self, client: Any, bucket: str, key: str, part_size: int):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Dict[str, Any]] = []
+
+    def _flush_part(self) -> None:
+        if self._upload_id is None:
+            self._upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        number = len(self._parts) + 1
+        resp = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                       PartNumber=number, Body=bytes(self._buffer))
+        self._parts.append({"ETag": resp["ETag"], "PartNumber": number})
+        self._buffer.clear()
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+        if len(self._buffer) >= self.part_size:
+            self._flush_part()
+
+    def commit(self) -> None:
+        if self._upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+            return
+        if self._buffer:
+            self._flush_part()
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                              MultipartUpload={"Parts": self._parts})
+
+    def abort(self) -> None:
+        if self._upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except ClientError as e:
+                logger.warning("Could not abort multipart upload %s: %s", self.key, e)
+
+
+class S3Backend(StorageBackend):
+    """
+    Objetos en un bucket compatible con S3 (AWS, MinIO, ...), bajo `prefix`.
+    Credenciales por la cadena habitual de boto3 (AWS_ACCESS_KEY_ID, ...).
+    Para probarlo en local basta un MinIO y S3_ENDPOINT_URL apuntando a él.
+    """
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+                 region: Optional[str] = S3_REGION, part_size: int = S3_PART_SIZE):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 necesita boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 necesita S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.part_size = part_size
+        self._client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    @contextmanager
+    def write(self, key: str) -> Iterator[_MultipartWriter]:
+        writer = _MultipartWriter(self._client, self.bucket, self._key(key), self.part_size)
+        try:
+            yield writer
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        args: Dict[str, Any] = {"Bucket": self.bucket, "Key": self._key(key)}
+        if start or end is not None:
+            args["Range"] = f"bytes={start}-{'' if end is None else end - 1}"
+        body = self._client.get_object(**args)["Body"]
+        try:
+            for chunk in body.iter_chunks(_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def delete(self, key: str) -> None:
+        self._client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def list(self) -> Iterator[Tuple[str, float]]:
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                yield obj["Key"][len(self.prefix):], obj["LastModified"].timestamp()
+
+
+def create_backend(root: str, kind: str = STORAGE_BACKEND, namespace: str = "") -> StorageBackend:
+    """
+    Backend según STORAGE_BACKEND; `root` es la carpeta del backend local.
+    En S3 las claves van bajo `S3_PREFIX<namespace>/`: cada catálogo lista
+    y borra solo lo suyo aunque varias réplicas compartan bucket.
+    """
+    if kind == "local":
+        return LocalBackend(root)
+    if kind == "s3":
+        return S3Backend(prefix=f"{S3_PREFIX}{namespace}/" if namespace else S3_PREFIX)
+    raise RuntimeError(f"STORAGE_BACKEND desconocido: {kind!r} (local | s3)")
@@ -0,0 +1,125 @@
+import os
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from app.utils import metrics
+from app.utils.catalog import catalog
+
+# Presupuesto de disco por grupo de carpetas (bytes; 0 = sin límite)
+STORAGE_MAX_BYTES_UPLOADS: int = int(os.getenv("STORAGE_MAX_BYTES_UPLOADS", str(2 * 1024 ** 3)))
+STORAGE_MAX_BYTES_PROCESSED: int = int(os.getenv("STORAGE_MAX_BYTES_PROCESSED", str(2 * 1024 ** 3)))
+# Lo usado hace menos de esto no se expulsa (cubre descargas/procesados de otros workers)
+STORAGE_PIN_SECONDS: int = int(os.getenv("STORAGE_PIN_SECONDS", "300"))
+# Al expulsar se baja hasta este porcentaje del presupuesto, para no expulsar en cada barrido
+STORAGE_LOW_WATERMARK: float = 0.9
+
+# processed/.cache apunta a los mismos blobs que processed/: mismo grupo, cada blob cuenta una vez
+STORAGE_GROUPS: Dict[str, Tuple[List[str], int]] = {
+    "uploads": (["uploads"], STORAGE_MAX_BYTES_UPLOADS),
+    "processed": (["processed", os.path.join("processed", ".cache")], STORAGE_MAX_BYTES_PROCESSED),
+}
+
+logger = logging.getLogger("cleanup_logger")
+
+
+class StorageBudget:
+    """
+    Límite de bytes por grupo de carpetas con expulsión LRU.
+    - Tamaños y último acceso salen del catálogo (app/utils/catalog.py), que
+      comparten todos los workers: enforce() no recorre directorios. Expulsar
+      es borrar los alias; el blob lo borra el janitor.
+    - touch() no escribe en el catálogo (se llama desde el event loop): anota
+      el acceso en memoria y flush() lo guarda de una vez en cada barrido del
+      janitor, en todos los workers. Ese retraso (JANITOR_INTERVAL_SECONDS) es
+      menor que STORAGE_PIN_SECONDS, así que no expulsa nada en uso.
+    - pin()/unpin() protegen lo que este proceso está procesando o sirviendo;
+      lo accedido hace menos de STORAGE_PIN_SECONDS tampoco se expulsa (cubre
+      lo que tienen en uso los demás workers).
+    - enforce() lo ejecuta el janitor que tiene el bloqueo (app/utils/cleanup.py).
+    """
+
+    def __init__(self, groups: Dict[str, Tuple[List[str], int]] = STORAGE_GROUPS,
+                 pin_seconds: int = STORAGE_PIN_SECONDS, low_watermark: float = STORAGE_LOW_WATERMARK):
+        self.groups = groups
+        self.pin_seconds = pin_seconds
+        self.low_watermark = low_watermark
+        self._pins: Counter = Counter()
+        self._touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, path: str) -> None:
+        """Marca `path` como recién usado sin tocar su mtime (se guarda en flush())."""
+        with self._lock:
+            self._touched[path] = time.time()
+
+    def flush(self) -> None:
+        """Guarda en el catálogo los accesos anotados por touch() (bloqueante)."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            catalog.touch(touched)
+
+    def pin(self, path: str) -> None:
+        with self._lock:
+            self._pins[os.path.abspath(path)] += 1
+
+    def unpin(self, path: str) -> None:
+        key = os.path.abspath(path)
+        with self._lock:
+            self._pins[key] -= 1
+            if self._pins[key] <= 0:
+                del self._pins[key]
+
+    @contextmanager
+    def pinned(self, *paths: str) -> Iterator[None]:
+        for path in paths:
+            self.pin(path)
+        try:
+            yield
+        finally:
+            for path in paths:
+                self.unpin(path)
+
+    def _is_pinned(self, paths: List[str], last_access: float, now: float) -> bool:
+        if now - last_access < self.pin_seconds:
+            return True
+        with self._lock:
+            return any(os.path.abspath(p) in self._pins for p in paths)
+
+    def enforce(self) -> int:
+        """Expulsa lo menos usado de cada grupo por encima de su presupuesto; devuelve bytes liberados."""
+        self.flush()
+        now = time.time()
+        freed_total = 0
+        for group, (folders, max_bytes) in self.groups.items():
+            used = catalog.usage(folders)
+            metrics.set_value(f"storage_{group}_bytes", used)
+            if not max_bytes or used <= max_bytes:
+                continue
+
+            target = int(max_bytes * self.low_watermark)
+            for paths, size, last_access in catalog.lru(folders):
+                if used <= target:
+                    break
+                if self._is_pinned(paths, last_access, now):
+                    metrics.incr("storage_evictions_skipped_pinned")
+                    continue
+                # Sin alias en el grupo el blob queda sin referencias: lo borra el janitor
+                catalog.unlink(*paths)
+                used -= size
+                freed_total += size
+                metrics.incr(f"storage_{group}_evictions")
+                metrics.incr("storage_evicted_bytes", size)
+                logger.info(f"📦 Evicted {', '.join(paths)} ({size} bytes, "
+                            f"idle {int(now - last_access)}s)")
+            metrics.set_value(f"storage_{group}_bytes", used)
+            if used > max_bytes:
+                logger.warning(f"⚠️ {group} still over budget ({used} > {max_bytes} bytes): all pinned")
+        return freed_total
+
+
+storage_budget = StorageBudget()
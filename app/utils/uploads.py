@@ -0,0 +1,209 @@
+import os
+import hashlib
+import tempfile
+from typing import Dict, List, Optional, Set
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Margen para cabeceras y separadores del multipart sobre el tamaño del fichero
+MULTIPART_OVERHEAD: int = 64 * 1024
+_SNIFF_BYTES = 12
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Tipo MIME según los magic bytes del inicio del fichero."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"The file exceeds the maximum allowed size {max_bytes // (1024 * 1024)} MB.",
+    )
+
+
+def _invalid_format() -> HTTPException:
+    return HTTPException(status_code=400, detail="Invalid image format. Only JPG/PNG/WebP are allowed.")
+
+
+class StreamedUpload:
+    """
+    Fichero recibido por bloques en un temporal dentro de `folder`:
+    SHA-256 incremental, límite de tamaño y tipo detectado por magic bytes.
+    Al aceptarlo se mueve al almacén de blobs (app/utils/blob_store.py),
+    en el mismo sistema de ficheros: solo un rename.
+    """
+
+    def __init__(self, folder: str, max_bytes: int, allowed_types: Set[str],
+                 filename: Optional[str] = None, declared_type: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.allowed_types = allowed_types
+        self.filename = filename
+        self.declared_type = declared_type
+        self.size = 0
+        self.mime: Optional[str] = None
+        self._head = b""
+        self._hash = hashlib.sha256()
+        os.makedirs(folder, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=folder, prefix=".upload-", suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+    def _sniff(self) -> None:
+        self.mime = sniff_image_type(self._head)
+        if self.mime not in self.allowed_types:
+            raise _invalid_format()
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise _too_large(self.max_bytes)
+        if self.mime is None:
+            self._head = (self._head + data)[:_SNIFF_BYTES]
+            if len(self._head) >= _SNIFF_BYTES:
+                self._sniff()
+        self._hash.update(data)
+        self._file.write(data)
+
+    def finish(self) -> None:
+        if self.mime is None:
+            self._sniff()
+        self._file.close()
+
+    def discard(self) -> None:
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+async def receive_multipart_file(request: Request, field: str, folder: str, max_bytes: int,
+                                 allowed_types: Set[str]) -> StreamedUpload:
+    """
+    Lee el campo de fichero `field` de un multipart/form-data directamente del
+    stream de la petición, sin esperar a tener el cuerpo completo: se rechaza
+    en cuanto Content-Length, el tipo declarado, los magic bytes o el número
+    de bytes recibidos no son válidos.
+    """
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes + MULTIPART_OVERHEAD:
+        raise _too_large(max_bytes)
+
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body.")
+
+    upload: Optional[StreamedUpload] = None
+    in_file = False
+    pending: List[bytes] = []
+    headers: Dict[bytes, bytes] = {}
+    header_field = bytearray()
+    header_value = bytearray()
+
+    def on_part_begin() -> None:
+        headers.clear()
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        header_field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        header_value.extend(data[start:end])
+
+    def on_header_end() -> None:
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished() -> None:
+        nonlocal upload, in_file
+        _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+        in_file = (
+            upload is None
+            and disposition.get(b"name", b"").decode() == field
+            and b"filename" in disposition
+        )
+        if in_file:
+            declared = headers.get(b"content-type", b"").decode("latin-1")
+            if declared not in allowed_types:
+                raise _invalid_format()
+            upload = StreamedUpload(folder, max_bytes, allowed_types,
+                                    filename=disposition[b"filename"].decode("utf-8", "replace"),
+                                    declared_type=declared)
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        if in_file:
+            pending.append(data[start:end])
+
+    def on_part_end() -> None:
+        nonlocal in_file
+        in_file = False
+
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except ValueError:  # MultipartParseError
+                raise HTTPException(status_code=400, detail="Malformed multipart body.")
+            if pending:
+                data = b"".join(pending)
+                pending.clear()
+                await run_in_threadpool(upload.write, data)
+        parser.finalize()
+        if upload is None:
+            raise HTTPException(status_code=400, detail=f"Missing file field '{field}'.")
+        await run_in_threadpool(upload.finish)
+    except BaseException:
+        if upload is not None:
+            upload.discard()
+        raise
+    return upload
+
+
+async def receive_raw_file(request: Request, folder: str, max_bytes: int, allowed_types: Set[str],
+                           filename: Optional[str] = None) -> StreamedUpload:
+    """
+    Igual que receive_multipart_file pero el cuerpo de la petición ES el
+    fichero (application/octet-stream o image/*): no hay multipart que analizar.
+    """
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise _too_large(max_bytes)
+
+    declared = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if declared != "application/octet-stream" and declared not in allowed_types:
+        raise _invalid_format()
+
+    upload = StreamedUpload(folder, max_bytes, allowed_types, filename=filename, declared_type=declared)
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(upload.write, chunk)
+        await run_in_threadpool(upload.finish)
+    except BaseException:
+        upload.discard()
+        raise
+    return upload
@@ -0,0 +1,66 @@
+"""
+Benchmark del modo por bandas (PROCESS_BANDS) sobre una sola imagen grande.
+
+    python -m benchmarks.bench_bands --megapixels 40 --repeat 3
+
+Mide solo process_frame (sin decodificar ni codificar) para 1..N bandas y
+muestra el speedup respecto a 1 banda. Cada configuración se ejecuta una
+vez sin medir (hilos, buffers de la arena, páginas del frame) antes de las
+repeticiones. Con --cv-threads 1 se desactiva el paralelismo interno de
+OpenCV para aislar el efecto de las bandas.
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from app.services.image_processing import process_frame
+
+
+def _synthetic_negative(megapixels: float, seed: int = 0) -> np.ndarray:
+    """Negativo sintético (gradientes + ruido) con la proporción 3:2 de un 35 mm."""
+    height = int((megapixels * 1e6 / 1.5) ** 0.5)
+    width = int(height * 1.5)
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([xx / width, yy / height, (xx + yy) / (width + height)], axis=-1) * 180 + 40
+    noise = rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-bands", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--cv-threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.cv_threads is not None:
+        cv2.setNumThreads(args.cv_threads)
+
+    source = _synthetic_negative(args.megapixels)
+    print(f"{source.shape[1]}x{source.shape[0]} ({args.megapixels} MP), "
+          f"cpu_count={os.cpu_count()}, cv2 threads={cv2.getNumThreads()}")
+
+    bands_list = sorted({1, *[2 ** k for k in range(1, 8) if 2 ** k <= args.max_bands], args.max_bands})
+    frame = np.empty_like(source)
+    baseline = None
+    for bands in bands_list:
+        # Calentamiento sin medir: la primera llamada paga arranques que las demás no
+        np.copyto(frame, source)
+        process_frame(frame, bands)
+        best = float("inf")
+        for _ in range(args.repeat):
+            np.copyto(frame, source)
+            start = time.perf_counter()
+            process_frame(frame, bands)
+            best = min(best, time.perf_counter() - start)
+        baseline = baseline or best
+        print(f"bands={bands:3d}  {best * 1000:8.1f} ms  speedup x{baseline / best:.2f}")
+
+
+if __name__ == "__main__":
+    main()
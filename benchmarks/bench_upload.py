@@ -0,0 +1,84 @@
+"""
+Benchmark de subida: /upload/raw (cuerpo = imagen) frente a /upload/ (multipart).
+
+    python -m benchmarks.bench_upload uploads/img8.jpg --repeat 20
+    python -m benchmarks.bench_upload foto.jpg --url http://localhost:8000
+
+Sin --url la app se ejecuta en el propio proceso (httpx + ASGI), así que se
+mide solo el coste del servidor: parseo, hash, validación y escritura. Cada
+petición lleva un contenido distinto (se añaden bytes tras el final de la
+imagen) para que el dedupe no se salte la escritura. En proceso, httpx
+espera a las tareas en segundo plano de cada respuesta: el procesado
+especulativo y la decodificación previa tras /upload/ se desactivan (salvo
+que se definan SPECULATIVE_PROCESSING / DECODED_CACHE_MAX_BYTES) para no
+medir el procesado en vez de la subida.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+# Antes de importar la app: su configuración se lee al importar
+os.environ.setdefault("SPECULATIVE_PROCESSING", "0")
+os.environ.setdefault("DECODED_CACHE_MAX_BYTES", "0")
+
+from main import app, lifespan  # noqa: E402
+
+
+def _variant(data: bytes, i: int) -> bytes:
+    # Los decodificadores ignoran lo que va tras el final de la imagen
+    return data + b"\0" * 8 + i.to_bytes(8, "little")
+
+
+async def _bench(client: httpx.AsyncClient, data: bytes, mime: str, name: str,
+                 raw: bool, repeat: int, offset: int) -> float:
+    best = float("inf")
+    for i in range(repeat):
+        body = _variant(data, offset + i)
+        start = time.perf_counter()
+        if raw:
+            r = await client.post("/upload/raw", params={"filename": name},
+                                  content=body, headers={"Content-Type": mime})
+        else:
+            r = await client.post("/upload/", files={"file": (name, body, mime)})
+        best = min(best, time.perf_counter() - start)
+        r.raise_for_status()
+    return best
+
+
+async def _run(args: argparse.Namespace) -> None:
+    with open(args.image, "rb") as f:
+        data = f.read()
+    mime = "image/png" if data.startswith(b"\x89PNG") else "image/jpeg"
+    name = os.path.basename(args.image)
+    mb = len(data) / (1024 * 1024)
+
+    async def bench(client: httpx.AsyncClient) -> None:
+        print(f"{name}: {mb:.2f} MB, repeat={args.repeat}")
+        for label, raw, offset in (("multipart", False, 0), ("raw", True, args.repeat)):
+            best = await _bench(client, data, mime, name, raw, args.repeat, offset)
+            print(f"{label:10s} {best * 1000:8.1f} ms  {mb / best:8.1f} MB/s")
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+            await bench(client)
+        return
+
+    async with lifespan(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            await bench(client)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--url", default=None, help="servidor ya arrancado (por defecto, en proceso)")
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Informe de tolerancia del modo proxy (PROXY_MIN_PIXELS) frente al cálculo exacto.
+
+    python -m benchmarks.proxy_tolerance escaneos/*.jpg --target-pixels 1500000
+
+Por imagen muestra el paso de submuestreo, cuánto difiere la salida de la
+LUT (máxima y media en niveles de 0..255, fracción de valores de canal que
+cambian) y el tiempo de las estadísticas exactas vs proxy.
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.services.image_processing import (
+    PROXY_TARGET_PIXELS,
+    channel_histograms,
+    pipeline_luts,
+    proxy_histograms,
+    proxy_tolerance_report,
+)
+
+
+def _timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--target-pixels", type=int, default=PROXY_TARGET_PIXELS)
+    args = parser.parse_args()
+
+    print(f"{'image':40s} {'MP':>6s} {'step':>4s} {'max':>4s} {'mean':>7s} {'changed':>8s} {'exact ms':>9s} {'proxy ms':>9s}")
+    for path in args.images:
+        frame = np.asarray(Image.open(path).convert("RGB"))
+        report = proxy_tolerance_report(frame, args.target_pixels)
+        exact_s = _timed(lambda: pipeline_luts(channel_histograms(frame)))
+        proxy_s = _timed(lambda: pipeline_luts(proxy_histograms(frame, report["step"])))
+        print(f"{path[-40:]:40s} {frame.shape[0] * frame.shape[1] / 1e6:6.1f} {report['step']:4d} "
+              f"{report['max_abs_diff']:4d} {report['mean_abs_diff']:7.3f} {report['changed_fraction']:8.2%} "
+              f"{exact_s * 1000:9.1f} {proxy_s * 1000:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Comprobación del backend S3 (app/utils/storage_backend.py) contra un
+servicio compatible: escritura por partes, lecturas por tramos, abort,
+exists/delete/list y que dos catálogos que comparten bucket no se borren
+blobs entre sí.
+
+    S3_ENDPOINT_URL=http://127.0.0.1:9000 AWS_ACCESS_KEY_ID=minioadmin \\
+    AWS_SECRET_ACCESS_KEY=minioadmin python -m benchmarks.s3_backend_check
+
+Sin S3_ENDPOINT_URL usa moto en el propio proceso (`pip install boto3 moto`).
+El bucket (S3_BUCKET, por defecto `ngrestore-check`) se crea si no existe;
+todo se escribe bajo el prefijo `check-<aleatorio>/` y se borra al final.
+"""
+import os
+import sys
+import uuid
+import shutil
+import hashlib
+import tempfile
+from contextlib import ExitStack
+
+# Catálogo temporal: se lee al importar la app
+_TMP = tempfile.mkdtemp(prefix="s3check-")
+os.environ["CATALOG_PATH"] = os.path.join(_TMP, "catalog.db")
+os.environ.setdefault("S3_BUCKET", "ngrestore-check")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from app.utils.storage_backend import S3_BUCKET, S3_ENDPOINT_URL, S3Backend, create_backend  # noqa: E402
+
+MIB = 1024 * 1024
+
+
+def _check(label: str, ok: bool) -> None:
+    print(f"{'ok  ' if ok else 'FAIL'} {label}")
+    if not ok:
+        sys.exit(1)
+
+
+def _read(backend: S3Backend, key: str, start: int = 0, end=None) -> bytes:
+    return b"".join(backend.read(key, start, end))
+
+
+def _run(bucket: str, prefix: str) -> None:
+    from app.utils.blob_store import BlobStore, file_digest
+    from app.utils.catalog import Catalog, catalog
+
+    backend = S3Backend(bucket=bucket, prefix=prefix, part_size=5 * MIB)
+    client = backend._client
+    try:
+        client.head_bucket(Bucket=bucket)
+    except Exception:
+        client.create_bucket(Bucket=bucket)
+
+    # Escritura por partes: 12 MiB en partes de 5 MiB (5 + 5 + 2)
+    data = os.urandom(12 * MIB + 123)
+    src = os.path.join(_TMP, "big.bin")
+    with open(src, "wb") as f:
+        f.write(data)
+    backend.put_file("big", src)
+    head = client.head_object(Bucket=bucket, Key=f"{prefix}big")
+    _check("multipart: tamaño", head["ContentLength"] == len(data))
+    _check("multipart: 3 partes", head["ETag"].strip('"').endswith("-3"))
+    _check("lectura completa", hashlib.sha256(_read(backend, "big")).digest() == hashlib.sha256(data).digest())
+    for start, end in ((0, 1), (5 * MIB - 10, 5 * MIB + 10), (len(data) - 1, len(data)), (10 * MIB, None)):
+        _check(f"tramo [{start}, {end})", _read(backend, "big", start, end) == data[start:end])
+
+    # Objeto pequeño: una sola petición
+    with backend.write("small") as out:
+        out.write(b"hola")
+    _check("objeto pequeño", _read(backend, "small") == b"hola")
+
+    # Un error a mitad aborta la subida: ni objeto ni partes pendientes
+    try:
+        with backend.write("aborted") as out:
+            out.write(os.urandom(6 * MIB))
+            raise RuntimeError("fallo simulado")
+    except RuntimeError:
+        pass
+    uploads = client.list_multipart_uploads(Bucket=bucket, Prefix=prefix).get("Uploads", [])
+    _check("abort: sin objeto", not backend.exists("aborted"))
+    _check("abort: sin partes pendientes", not uploads)
+
+    _check("list", sorted(k for k, _ in backend.list()) == ["big", "small"])
+    backend.delete("big")
+    backend.delete("small")
+    _check("delete", not backend.exists("big") and list(backend.list()) == [])
+
+    # Dos réplicas con su catálogo y el mismo bucket: la reconciliación de una
+    # no borra lo que subió la otra
+    other = Catalog(os.path.join(_TMP, "other.db"))
+    theirs = create_backend(_TMP, "s3", namespace=other.instance_id())
+    ours = create_backend(_TMP, "s3", namespace=catalog.instance_id())
+    for b in (theirs, ours):
+        b.prefix = f"{prefix}{b.prefix}"
+    store = BlobStore(root=os.path.join(_TMP, "blobs"), grace=0, backend=ours)
+    with open(src, "wb") as f:
+        f.write(b"contenido de la otra replica")
+    digest = file_digest(src)
+    theirs.put_file(store.key(digest), src)
+    store.backend.put_file(store.key("0" * 64), src)  # huérfano propio
+    store.reconcile()
+    _check("réplicas: lo de la otra sigue", theirs.exists(store.key(digest)))
+    _check("réplicas: el huérfano propio se borra", not ours.exists(store.key("0" * 64)))
+    theirs.delete(store.key(digest))
+
+
+def main() -> None:
+    bucket = S3_BUCKET
+    prefix = f"check-{uuid.uuid4().hex[:8]}/"
+    with ExitStack() as stack:
+        if S3_ENDPOINT_URL:
+            print(f"S3 en {S3_ENDPOINT_URL}, bucket {bucket}")
+        else:
+            try:
+                from moto import mock_aws
+            except ImportError:
+                sys.exit("Sin S3_ENDPOINT_URL hace falta moto (pip install boto3 moto)")
+            stack.enter_context(mock_aws())
+            print(f"moto en proceso, bucket {bucket}")
+        try:
+            _run(bucket, prefix)
+        finally:
+            shutil.rmtree(_TMP, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,39 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Dict
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from app.routes import router
+from app.services.worker_pool import processing_pool
+from app.services.decoded_cache import decoded_cache
+from app.services.jobs import job_queue
+from app.utils.cleanup import janitor
+from app.utils.blob_store import blob_store
 
-# --- Utilidades ---
-class NoCacheStaticFiles(StaticFiles):
-    """Sirve archivos estáticos sin caché del navegador."""
+# Crear directorios necesarios (idempotente)
+Path(blob_store.staging).mkdir(parents=True, exist_ok=True)
 
-    def set_headers(self, response, full_path, stat_result) -> None:  # type: ignore[override]
-        super().set_headers(response, full_path, stat_result)
-        response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-        response.headers["Pragma"] = "no-cache"
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pool de procesos para process_image: vive lo mismo que la app
+    processing_pool.start()
+    job_queue.start()
+    # Limpieza periódica de nombres y blobs (reconcilia con el disco al arrancar)
+    janitor.start()
+    try:
+        yield
+    finally:
+        await janitor.stop()
+        await job_queue.stop()
+        await processing_pool.stop()
+        # Bloques de memoria compartida con imágenes decodificadas
+        decoded_cache.clear()
 
-# Crear directorios necesarios (idempotente)
-Path("uploads").mkdir(exist_ok=True)
-Path("processed").mkdir(exist_ok=True)
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configuración de CORS
 app.add_middleware(
@@ -35,14 +47,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Nombres guardados que devuelve /upload-and-process/
+    expose_headers=["X-Upload-Filename", "X-Processed-Filename"],
 )
 
 # Rutas de la aplicación
 app.include_router(router)
 
-# Montar la carpeta uploads como estática, sin caché
-app.mount("/uploads", NoCacheStaticFiles(directory="uploads"), name="uploads")
-
 # Healthcheck simple
 @app.get("/healthz")
 async def healthz() -> Dict[str, bool]: